@@ -0,0 +1,124 @@
+# Columnar store of the QA bank, row-aligned with model_func.QuestionIndex.
+# Every row has its qid and question; every answer is held once per QA pair, however many
+# questions share it, and a row finds its answer through an array of answer slots.
+# Like QuestionIndex, a store is modified in place by the writes applied on the event loop, and
+# every ask looks its rows up right after searching the index, without awaiting in between,
+# so the two are always seen aligned. A reload builds a new store on a thread and swaps it in
+# on the event loop as well (chatbotAPI.swapData), together with its index.
+import numpy as np
+from .model_func import compact_rows
+
+def _objectArray(list_text):
+    # An object array of the texts themselves (np.array would make a fixed-width string array)
+    arr = np.empty(len(list_text), dtype=object)
+    arr[:] = list(list_text)
+    return arr
+
+class AnswerStore:
+    def __init__(self, qids, questions, answers):
+        """
+            Inputs:
+                qids (array-like): qid of every row
+                questions (array-like): Question of every row
+                answers (dict): qid -> answer, for every qid of the rows
+        """
+        # A private copy, the rows are modified in place (qids may be a read-only memmap)
+        self._qids = np.array(qids, dtype=np.int64)
+        self._questions = _objectArray(questions)
+        self._size = self._qids.shape[0]
+        self.answers = answers
+        # One answer per distinct qid, and the slot of the answer of every row
+        arr_qid, self._answer_slots = np.unique(self._qids, return_inverse=True)
+        self._answer_slots = self._answer_slots.astype(np.int64).reshape(-1)
+        self._answer_texts = _objectArray([answers[qid] for qid in arr_qid.tolist()])
+        # qid -> slot of its answer, and the slots freed by removed QA pairs
+        self._slots = dict(zip(arr_qid.tolist(), range(arr_qid.shape[0])))
+        self._free_slots = []
+
+    @classmethod
+    def from_rows(cls, qids, questions, row_answers):
+        """
+            Build a store from rows that each carry the answer of their QA pair (as stored in MySQL)
+        """
+        return cls(qids, questions, dict(zip(np.asarray(qids).tolist(), row_answers)))
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], {})
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def qids(self):
+        return self._qids[:self._size]
+
+    @property
+    def questions(self):
+        return self._questions[:self._size]
+
+    def qid(self, row):
+        return int(self._qids[row])
+
+    def answer(self, row):
+        """
+            Answer of the QA pair of a row
+        """
+        return self._answer_texts[self._answer_slots[row]]
+
+    def _dropRows(self, keep):
+        # Same compaction as QuestionIndex.remove_qids, so the rows stay aligned with the index
+        self._size = compact_rows([self._qids, self._questions, self._answer_slots], ~keep, self._size)
+
+    def remove(self, keep, list_qid):
+        """
+            Remove the rows of deleted QA pairs, as QuestionIndex.remove_qids did
+            Inputs:
+                keep (ndarray): Boolean mask of the rows kept, as returned by QuestionIndex.remove_qids
+                list_qid (list): QA ids of the removed rows
+        """
+        self._dropRows(keep)
+        for qid in list_qid:
+            self.answers.pop(qid, None)
+            slot = self._slots.pop(qid, None)
+            if slot is not None:
+                self._answer_texts[slot] = None
+                self._free_slots.append(slot)
+
+    def upsert(self, keep, qid, list_q, answer):
+        """
+            Append the rows of a created or updated QA pair, as QuestionIndex.replace did
+            An updated QA pair keeps the slot of its answer; a new one takes a freed slot or a new one.
+            Inputs:
+                keep (ndarray): Boolean mask of the rows kept, as returned by QuestionIndex.replace
+                qid (int): QA id of the new rows
+                list_q (list): Questions of the QA pair
+                answer (str): Answer of the QA pair
+        """
+        self._dropRows(keep)
+        slot = self._slots.get(qid)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+            else:
+                slot = len(self._slots)
+                if slot >= self._answer_texts.shape[0]:
+                    answer_texts = np.empty(max(2 * slot, 16), dtype=object)
+                    answer_texts[:slot] = self._answer_texts
+                    self._answer_texts = answer_texts
+            self._slots[qid] = slot
+        self._answer_texts[slot] = answer
+        self.answers[qid] = answer
+
+        m = len(list_q)
+        if self._size + m > self._qids.shape[0]:
+            capacity = max(self._size + m, 2 * self._qids.shape[0], 16)
+            for name in ("_qids", "_questions", "_answer_slots"):
+                arr = getattr(self, name)
+                grown = np.empty(capacity, dtype=arr.dtype)
+                grown[:self._size] = arr[:self._size]
+                setattr(self, name, grown)
+        self._qids[self._size:self._size + m] = qid
+        self._questions[self._size:self._size + m] = list(list_q)
+        self._answer_slots[self._size:self._size + m] = slot
+        self._size += m
@@ -0,0 +1,32 @@
+from . import config
+from . import logger
+import os
+from .database.mysql_funcs import countQuestionAnswer
+from .qa_import import importQA
+from .embedding_jobs import processJobs
+from .model_func import get_model
+
+# Run by prestart.sh before the app starts: import the QA excel (config.QADB) if QA table is empty
+logger_checkQA = logger.setForWritefile("checkQAmysql", "app/logs/checkQAmysql.log")
+
+n = countQuestionAnswer(logger_checkQA)
+if n is None:
+    print("Failed to count QA data in MySQL")
+elif n > 0:
+    print(f"{n} QA pairs exist in MySQL, skip importing")
+elif not os.path.exists(config.QADB):
+    print(f"{config.QADB} does not exist, skip importing")
+else:
+    print(f"import QA from {config.QADB}")
+    with open(config.QADB, "rb") as f:
+        result = importQA(f, os.path.splitext(config.QADB)[1].lstrip(".").lower(), logger_checkQA)
+    print(f"imported {result['qa']} QA pairs ({result['questions']} questions), skipped {result['skipped']} rows")
+    if result["error"]:
+        print(result["error"])
+    # No worker serves yet: run the embedding jobs of the import here, so the QA bank is answerable at startup
+    if result["qa"] > 0:
+        model = get_model()
+        n = 0
+        while (list_applied := processJobs(model, logger_checkQA)) is not None:
+            n += len(list_applied)
+        print(f"embedded {n} QA pairs")
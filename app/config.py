@@ -5,9 +5,82 @@ mode = os.environ["MODE"]
 top = 7
 threshold = 0.9
 second_threshold = 0.8
+# "question": the top k most similar questions (several may belong to one QA pair);
+# "answer": the top k QA pairs, each scored by its most similar question (k distinct answers)
+retrieval_mode = os.getenv("RETRIEVAL_MODE", "question")
+# Maximum number of questions of one POST /chatbot/ask/batch
+ask_batch_max = 256
+
+# Sentence embedding model
+model_name = "all-MiniLM-L6-v2"
+# Encoder backend (app/encoders.py): "sentence-transformers", "int8", "onnx" or "hashing"
+encoder_model = {"backend": os.getenv("ENCODER_BACKEND", "sentence-transformers"),
+                 "model_dir": os.getenv("ENCODER_MODEL_DIR", f"/app/models/{model_name}-onnx"),  # onnx: exported model
+                 "onnx_file": os.getenv("ENCODER_ONNX_FILE", "model.onnx"),
+                 "num_threads": int(os.getenv("ENCODER_THREADS", "0")),  # CPU threads of a forward pass (0: library default)
+                 "max_length": 256,  # onnx: tokens per text
+                 "hashing_dim": 384,
+}
+# Per-question embedding cache (LRU), bounded by entry count and by memory
+embedding_cache_size = 10000
+embedding_cache_max_bytes = 64 * 1024 * 1024
+# Micro-batching of /chatbot/ask encodes: wait up to the window (ms) or until the batch is full
+encoder_batch_window_ms = 5
+encoder_max_batch = 32
+
+# Load the model weights and the QA data in the gunicorn master before forking (gunicorn_conf.py sets preload_app)
+preload_app = os.getenv("PRELOAD_APP", "false").lower() == "true"
+
+# Seconds between checks of the QA bank version in MySQL (keeps gunicorn workers in sync)
+version_check_ttl = 1.0
+# More QA bank changes than this since the last sync (e.g. a bulk import) are loaded by a full reload
+sync_max_changes = 1000
+
+# Memory-mapped QA snapshot shared by the workers of a host; empty string to always load from MySQL
+snapshot_path = os.getenv("QA_SNAPSHOT_PATH", "/app/app/snapshot/qa_snapshot.bin")
+
+# Storage precision of the in-memory question matrix: "float32", "float16" or "int8" (per-row scaled)
+# float16 only halves the memory: its scans are still slower than float32 (rows are widened chunk by chunk),
+# while int8 quarters the memory and scans as fast (see benchmarks/bench_precision.py)
+index_precision = os.getenv("INDEX_PRECISION", "float32")
+# Retrieval index: "exact" scans every question, "ivf" only scans the closest clusters (approximate)
+index_mode = os.getenv("INDEX_MODE", "exact")
+ivf = {"n_lists": 0,  # number of clusters; 0 picks about sqrt(number of questions)
+       "n_probe": 8,  # clusters scanned per ask; more is slower but closer to exact
+       "n_iter": 10,  # k-means iterations when building
+       "min_rows": 10000,  # smaller banks are always scanned exactly
+       "path": os.getenv("QA_IVF_PATH", "/app/app/snapshot/qa_ivf.npz"),
+}
 
 # latest Question and Answer excel
 QADB = f"/app/app/QA.xlsx"
+# Page size of GET /manage/QA (default and maximum)
+qa_page_size = 100
+qa_page_max = 1000
+# Background embedding of admin writes (createQA/updateQA enqueue a job per QA pair)
+embedding_jobs = {"runner": os.getenv("EMBEDDING_RUNNER", "process"),  # "process": only `python -m app.embedding_jobs` runs them
+                                                                        # (the embedding-runner service of docker-compose);
+                                                                        # "app": every app worker runs jobs in a background thread
+                  "batch_size": 64,  # jobs claimed and encoded together
+                  "poll_interval": 2,  # seconds between checks for jobs enqueued elsewhere
+                  "max_attempts": 5,  # a job failing this many times is marked failed
+                  "retry_delay": 10,  # seconds before a failed job is retried (doubles with every attempt)
+                  "lease": 300,  # seconds after which a running job whose runner died is claimed again
+                  "process_threads": 2,  # job threads of the standalone process
+}
+
+# Bulk QA import (POST /manage/QA/import and app.checkQAmysql)
+import_chunk_size = 1000  # QA pairs inserted per transaction, each with its embedding job
+import_encode_batch = 256  # texts per forward pass of the encoder (embedding jobs)
+
+# Sampled profiling of requests (app/profiling.py); PUT /manage/profiling switches it at run time
+profiling = {"enabled": os.getenv("PROFILING", "false").lower() == "true",
+             "sample_rate": float(os.getenv("PROFILING_SAMPLE_RATE", "0.01")),  # fraction of the matching requests profiled
+             "paths": ("/chatbot/ask", "/manage/"),  # path prefixes of the requests that may be profiled
+             "dir": os.getenv("PROFILING_DIR", "app/logs/profiles"),
+             "max_files": 200,  # newest profiles kept on a host
+             "refresh": 2,  # seconds between checks of the settings saved by PUT /manage/profiling
+}
 
 # test
 class test_user:
@@ -16,11 +89,35 @@ class test_user:
 
 # database 
 ## redis
-aioredis_redis = {"address": ("redis", 6379), "password": os.environ["REDIS_LOGIN_PWD"]}
+aioredis_redis = {"address": ("redis", 6379), "password": os.environ["REDIS_LOGIN_PWD"],
+                  "timeout": 0.5,  # seconds; a slower Redis is treated as down
+                  "retry_interval": 5,  # seconds before retrying Redis after a failure (meanwhile values are kept in memory)
+}
+## conversation sessions (state and candidate qids of each uid)
+session = {"backend": os.getenv("SESSION_BACKEND", "redis"),  # "redis" (shared by workers) or "local" (per worker)
+           "ttl": 600,  # seconds of inactivity before a session expires
+           "prefix": "chatbot:session:",
+           "local_max": 100000,  # sessions kept in memory per worker when Redis is down or not used
+}
+## cached /chatbot/ask results per (normalized question, QA bank version)
+response_cache = {"enabled": True,
+                  "backend": os.getenv("RESPONSE_CACHE_BACKEND", "local"),  # "local" (per worker) or "redis" (also shared)
+                  "ttl": 3600,  # seconds
+                  "prefix": "chatbot:response:",
+                  "local_max": 50000,  # entries kept in memory per worker
+}
 ## mysql
 mysql = {"host": "mysql", "user": "root", "password": os.environ["MYSQL_LOGIN_PWD"], "database": "chatbot",
          "table-QA": "questionAnswer",
-         "table-QA-emb": "questionEmbedding"
+         "table-QA-emb": "questionEmbedding",
+         "table-QA-log": "questionChangeLog",
+         "table-QA-version": "questionVersion",
+         "table-emb-job": "embeddingJob"
+}
+## mysql connection pool (per worker process)
+mysql_pool = {"min_size": 1, "max_size": 10,
+              "health_check_interval": 30,  # seconds a connection may sit idle before it is pinged
+              "acquire_timeout": 10,  # seconds to wait for a free connection
 }
 
 APP_IP = os.environ["APP_IP"] + ":" + os.environ["APP_PORT"]
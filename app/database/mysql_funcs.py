@@ -1,44 +1,222 @@
 from logging import Logger
 from typing import List, Tuple, Dict
+import asyncio
+import functools
 import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .. import config
+from ..metrics import timeDB
+from .. import profiling
+from ..encoders import encoderId
 import pymysql
 from contextlib import contextmanager
 from fastapi import HTTPException
-import pandas as pd
+import numpy as np
 
-@contextmanager
-def mysql_conn():
+# Question embeddings are stored as raw little-endian float32 bytes
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+class MySQLPool:
     """
-        Create a MySQL connection object
+        Thread-safe pool of pymysql connections with a min/max size.
+        Connections idle for longer than health_check_interval are pinged before reuse
+        and replaced if the ping fails.
     """
-    try:
-        conn = pymysql.connect(host=config.mysql["host"],
+    def __init__(self, min_size, max_size, health_check_interval, acquire_timeout):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = deque()  # (connection, time it was released)
+        self._size = 0  # idle + in use
+        self._cond = threading.Condition()
+        try:
+            for _ in range(min_size):
+                self._idle.append((self._connect(), time.monotonic()))
+                self._size += 1
+        except:
+            # MySQL is not reachable yet; connections are opened on demand instead
+            pass
+
+    def _connect(self):
+        return pymysql.connect(host=config.mysql["host"],
                                user=config.mysql["user"],
                                password=config.mysql["password"],
                                database=config.mysql["database"],
                                cursorclass=pymysql.cursors.DictCursor,
                             )
+
+    def _check(self, conn, released_at):
+        """
+            Return a usable connection: conn itself, or a fresh one if conn went stale
+        """
+        if time.monotonic() - released_at < self.health_check_interval:
+            return conn
+        try:
+            conn.ping(reconnect=True)
+            return conn
+        except:
+            self._discard(conn)
+            return self._connect()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except:
+            pass
+
+    def acquire(self):
+        with self._cond:
+            deadline = time.monotonic() + self.acquire_timeout
+            while not self._idle and self._size >= self.max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or not self._cond.wait(timeout):
+                    raise TimeoutError("Timed out waiting for a MySQL connection")
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+                self._size += 1
+        try:
+            if conn is None:
+                return self._connect()
+            return self._check(conn, released_at)
+        except:
+            # The slot is given back if no connection could be made
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        if not broken:
+            try:
+                # Never hand an open transaction to the next user
+                conn.rollback()
+            except:
+                broken = True
+        with self._cond:
+            if broken:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+                self._size -= 1
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Blocking MySQL calls from async handlers run here; one thread per pooled connection at most
+_executor = None
+_executor_pid = None
+
+def getPool():
+    """
+        Return the connection pool of this process, creating it on first use
+        (and again in a forked child, which must not share its parent's sockets)
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = MySQLPool(**config.mysql_pool)
+                _pool_pid = os.getpid()
+    return _pool
+
+def closePool():
+    """
+        Close the connections of this process's pool, e.g. in the gunicorn master after preloading,
+        so that the forked workers do not inherit its sockets (they open their own pool)
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+def getExecutor():
+    """
+        Return the thread pool that runs blocking MySQL calls for this process
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _pool_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=config.mysql_pool["max_size"],
+                                               thread_name_prefix="mysql")
+                _executor_pid = os.getpid()
+    return _executor
+
+@contextmanager
+def mysql_conn():
+    """
+        Borrow a MySQL connection object from the pool
+    """
+    try:
+        pool = getPool()
+        conn = pool.acquire()
     except:
         raise HTTPException(424 , "Failed to connect to MySQL database")
+    broken = False
     try:
         yield conn
+    except (pymysql.err.OperationalError, pymysql.err.InterfaceError, GeneratorExit):
+        # GeneratorExit: a generator streaming rows was closed early (e.g. the client went away);
+        # the connection still has unread rows, so it is discarded instead of drained
+        broken = True
+        raise
     finally:
-        conn.close()
+        pool.release(conn, broken=broken)
+
+async def runDB(func, *args, **kwargs):
+    """
+        Run a blocking MySQL function on the database thread pool and await its result,
+        so async handlers do not stall the event loop while MySQL responds
+        Inputs:
+            func (callable): Any function of this module (or one built on mysql_conn)
+            args, kwargs: Arguments of func
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(getExecutor(), functools.partial(profiling.call, func, *args, **kwargs))
+
+def encodeEmbedding(embedding) -> bytes:
+    """
+        Serialize one embedding vector to the binary format of the question_emb column
+    """
+    return np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
 
+def decodeEmbedding(blob: bytes):
+    """
+        Deserialize one question_emb value into a float32 vector (a read-only view over the bytes)
+    """
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+@timeDB
 def createQuestionAnswer(
         questions: List[str],
         answer: str,
         logger: Logger,
     ):
     """
-        Insert a QA then return last ID of the table
+        Insert a QA and enqueue the embedding of its questions in a single transaction
         Inputs:
             questions (list): A list of similar questions belonging to the same answer
             answer (str): Answer to the question
             logger (Logger): A logging object for logging errors
         Returns:
             id (str): Last ID in the table
+            job_id (int): ID of the embedding job
             None if there is an error
     """
     try:
@@ -50,7 +228,7 @@ def createQuestionAnswer(
                     """
 
             # Dump a list of questions to json format
-            question = json.dumps(question)
+            questions = json.dumps(questions)
                 
             # Create a cursor
             cursor = mysql.cursor()
@@ -62,16 +240,83 @@ def createQuestionAnswer(
                     SELECT LAST_INSERT_ID();
                 """   
             cursor.execute(sql)
-            mysql.commit()
             # Fetch last id
             id = cursor.fetchall()[0]['LAST_INSERT_ID()']
+            job_id = insertEmbeddingJob(cursor, id)
+            mysql.commit()
             # Close the cursor
             cursor.close()
-        return id
+        return id, job_id
     except:
         logger.exception("An error occurred while inserting a row into QA table")
         return None
 
+@timeDB
+def createQuestionAnswerBatch(
+        list_qa: List[Tuple[List[str], str]],
+        logger: Logger,
+    ):
+    """
+        Insert many QA pairs together with their embedding jobs in a single transaction, so that a chunk
+        of a bulk import is either fully stored or not at all. The embedding runners encode the questions
+        and log the changes, as for createQuestionAnswer.
+        Inputs:
+            list_qa (list): A list of (questions, answer) tuples
+            logger (Logger): A logging object for logging errors
+        Returns:
+            list_id (list): IDs of the inserted QA pairs, aligned with list_qa
+            None if there is an error
+    """
+    try:
+        with mysql_conn() as mysql:
+            # Create a cursor
+            cursor = mysql.cursor()
+            # QA pairs are inserted one by one to get their AUTO_INCREMENT IDs, like createQuestionAnswer
+            # (the IDs of a multi-row insert are not guaranteed to be consecutive)
+            sql = f"""
+                    insert into {config.mysql["table-QA"]}
+                    (question,answer) values (%(question)s,%(answer)s);
+                    """
+            list_id = []
+            for questions, answer in list_qa:
+                cursor.execute(sql, {"question": json.dumps(questions), "answer": answer})
+                list_id.append(cursor.lastrowid)
+            # executemany() sends these as a multi-row INSERT statement
+            cursor.executemany(f"""insert into {config.mysql["table-emb-job"]} (qid) values (%s);""",
+                               [(id,) for id in list_id])
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
+        return list_id
+    except:
+        logger.exception("An error occurred while inserting a batch of rows into QA tables")
+        return None
+
+@timeDB
+def countQuestionAnswer(logger: Logger):
+    """
+        Count QA pairs
+        Inputs:
+            logger (Logger): A logging object for logging errors
+        Returns:
+            n (int): Number of rows in QA table
+            None if there is an error
+    """
+    try:
+        with mysql_conn() as conn:
+            # Create a cursor
+            cursor = conn.cursor()
+            # Execute SQL command
+            cursor.execute(f"""SELECT COUNT(*) AS n FROM {config.mysql["table-QA"]}""")
+            n = cursor.fetchone()["n"]
+            # Close the cursor
+            cursor.close()
+        return n
+    except:
+        logger.exception("An error occurred while counting rows of QA table")
+        return None
+
+@timeDB
 def getQuestionAnswer(
         id: int,
         logger: Logger,
@@ -87,16 +332,14 @@ def getQuestionAnswer(
     """
     try:
         with mysql_conn() as conn:
-            sql = f"""SELECT * FROM {config.mysql["table-QA"]} WHERE id={id}"""
+            sql = f"""SELECT * FROM {config.mysql["table-QA"]} WHERE id=%(id)s"""
             
-            # Check if the connection works
-            conn.ping(reconnect=True)
             # Create a cursor
             cursor = conn.cursor()
             # Execute SQL command
-            cursor.execute(sql)
-            # Fetch all data
-            data = cursor.fetch()
+            cursor.execute(sql, {"id": id})
+            # Fetch the data (None if id does not exist)
+            data = cursor.fetchone()
             # Close the cursor
             cursor.close()
         return data
@@ -104,6 +347,7 @@ def getQuestionAnswer(
         logger.exception("An error occurred while fetching all data from QA table")
         return False
     
+@timeDB
 def updateQuestionAnswer(
         id: int,
         questions: List[str],
@@ -111,15 +355,16 @@ def updateQuestionAnswer(
         logger: Logger,
     ):
     """
-        Update a certain question-answer pair by id
+        Update a certain question-answer pair by id and enqueue the embedding of its questions
+        in a single transaction
         Inputs:
             id (int): ID of a QA pair
             questions (list): A list of similar questions belonging to the same answer
             answer (str): Answer to the question
             logger (Logger): A logging object for logging errors
         Returns:
-            True if the data is successfully updated
-            False if there is an error
+            job_id (int): ID of the embedding job
+            None if there is an error
 
     """
     try:
@@ -131,78 +376,82 @@ def updateQuestionAnswer(
                     WHERE id=%(id)s
                     """
             # Dump a list of questions to json format
-            question = json.dumps(question)
+            questions = json.dumps(questions)
                 
             # Create a cursor
             cursor = mysql.cursor()
             # Execute SQL command
             cursor.execute(sql, {"id": id, "question": questions, "answer": answer})
+            job_id = insertEmbeddingJob(cursor, id)
             mysql.commit()
             # Close the cursor
             cursor.close()
-        return True
+        return job_id
     except:
         logger.exception("An error occurred while updating a data into QA table")
-        return False
+        return None
 
+@timeDB
 def deleteQuestionAnswer(
         id: int,
         logger: Logger
     ):
     """
-        Delete a certain question-answer pair by id
+        Delete a certain question-answer pair by id, with its question embeddings, and log the change,
+        in a single transaction
         Inputs:
             id (int): ID of a QA pair
             logger (Logger): A logging object for logging errors
         Returns:
-            True if the data is successfully deleted
-            False if there is an error
+            version (int): The new QA bank version
+            None if there is an error
     """
     try:
         with mysql_conn() as mysql:
-            # SQL command for deleting an existing data
-            sql = f"""
-                    DELETE FROM {config.mysql["table-QA"]} WHERE id={id}
-                    """
             # Create a cursor
             cursor = mysql.cursor()
             # Execute SQL command
-            cursor.execute(sql)
+            cursor.execute(f"""DELETE FROM {config.mysql["table-QA"]} WHERE id=%(id)s""", {"id": id})
+            cursor.execute(f"""DELETE FROM {config.mysql["table-QA-emb"]} WHERE qid=%(id)s""", {"id": id})
+            # Bump the QA bank version so that other workers pick up the change
+            version = bumpQAVersion(cursor, [(id, "delete")])[0]
             mysql.commit()
             # Close the cursor
             cursor.close()
-        return True
+        return version
     except:
-        logger.exception("An error occurred while deleting a data from QA table")
-        return False
+        logger.exception("An error occurred while deleting a data from QA tables")
+        return None
     
+@timeDB
 def deleteAllQuestionAnswer(logger: Logger):
     """
-        Delete all question-answer pairs
+        Delete all question-answer pairs and question embeddings, and log a "clear" change,
+        in a single transaction
         Inputs:
             logger (Logger): A logging object for logging errors
         Returns:
-            True if the data is successfully deleted
-            False if there is an error
+            version (int): The new QA bank version
+            None if there is an error
     """
     try:
         with mysql_conn() as mysql:
-            # SQL command for deleting all data
-            sql = f"""
-                    TRUNCATE {config.mysql["table-QA"]}
-                    """
             # Create a cursor
             cursor = mysql.cursor()
-            # Execute SQL command
-            cursor.execute(sql)
+            # DELETE rather than TRUNCATE, which would commit
+            cursor.execute(f"""DELETE FROM {config.mysql["table-QA"]}""")
+            cursor.execute(f"""DELETE FROM {config.mysql["table-QA-emb"]}""")
+            # Bump the QA bank version so that other workers pick up the change
+            version = bumpQAVersion(cursor, [(None, "clear")])[0]
             mysql.commit()
             # Close the cursor
             cursor.close()
-        return True
+        return version
     except:
-        logger.exception("An error occurred while deleting all data from QA table")
-        return False
+        logger.exception("An error occurred while deleting all data from QA tables")
+        return None
 
+@timeDB
 def getAllQuestionAnswer(
         logger: Logger,
     ):
@@ -218,8 +467,6 @@ def getAllQuestionAnswer(
         with mysql_conn() as conn:
             sql = f"""SELECT * FROM {config.mysql["table-QA"]}"""
             
-            # Check if the connection works
-            conn.ping(reconnect=True)
             # Create a cursor
             cursor = conn.cursor()
             # Execute SQL command
@@ -233,6 +480,74 @@ def getAllQuestionAnswer(
         logger.exception("An error occurred while fetching all data from QA table")
         return False
 
+@timeDB
+def getQuestionAnswerPage(
+        after_id: int,
+        limit: int,
+        logger: Logger,
+    ):
+    """
+        Get one page of question-answer pairs ordered by id (keyset pagination)
+        Inputs:
+            after_id (int): Only QA pairs with a larger id are returned (0 for the first page)
+            limit (int): Maximum number of QA pairs
+            logger (Logger): A logging object for logging errors
+        Returns:
+            list_data (list): A list of dictionaries of QA pairs
+            False if there is an error
+    """
+    try:
+        with mysql_conn() as conn:
+            # Seek on the primary key instead of OFFSET, so every page costs the same
+            sql = f"""SELECT * FROM {config.mysql["table-QA"]} WHERE id > %(after_id)s ORDER BY id LIMIT %(limit)s"""
+
+            # Create a cursor
+            cursor = conn.cursor()
+            # Execute SQL command
+            cursor.execute(sql, {"after_id": after_id, "limit": limit})
+            # Fetch the page
+            list_data = cursor.fetchall()
+            # Close the cursor
+            cursor.close()
+        return list_data
+    except:
+        logger.exception("An error occurred while fetching a page of data from QA table")
+        return False
+
+def iterQuestionAnswer(
+        logger: Logger,
+        batch_size: int = 1000,
+    ):
+    """
+        Stream all question-answer pairs ordered by id through an unbuffered server-side cursor,
+        so memory stays flat whatever the size of the table
+        Inputs:
+            logger (Logger): A logging object for logging errors
+            batch_size (int): Rows fetched from the server at a time
+        Returns:
+            A generator of lists of at most batch_size dictionaries of QA pairs
+            Errors are logged and re-raised, so a consumer never mistakes a cut-off stream for the whole table
+    """
+    try:
+        with mysql_conn() as conn:
+            # Create an unbuffered cursor
+            cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+            # Execute SQL command
+            cursor.execute(f"""SELECT * FROM {config.mysql["table-QA"]} ORDER BY id""")
+            while True:
+                list_data = cursor.fetchmany(batch_size)
+                if not list_data:
+                    break
+                yield list_data
+            # Close the cursor
+            cursor.close()
+    except GeneratorExit:
+        raise
+    except:
+        logger.exception("An error occurred while streaming data from QA table")
+        raise
+
+@timeDB
 def getAllQuestionEmbedding(
         logger: Logger,
     ):
@@ -249,8 +564,6 @@ def getAllQuestionEmbedding(
         with mysql_conn() as conn:
             sql = f"""SELECT * FROM {config.mysql["table-QA-emb"]}"""
             
-            # Check if the connection works
-            conn.ping(reconnect=True)
             # Create a cursor
             cursor = conn.cursor()
             # Execute SQL command
@@ -259,12 +572,236 @@ def getAllQuestionEmbedding(
             list_data = cursor.fetchall()
             # Close the cursor
             cursor.close()
+        # Only this legacy function needs pandas; the app does not import it otherwise
+        import pandas as pd
         return pd.DataFrame(list_data)
     except:
         logger.exception("An error occurred while fetching all data from QA embedding table")
         return False
 
 
+@timeDB
+def getAllQuestionEmbeddingMatrix(
+        logger: Logger,
+    ):
+    """
+        Get all question-answer pairs together with their embeddings as one matrix
+        Rows are streamed with an unbuffered cursor and each embedding is decoded with
+        np.frombuffer straight into a preallocated float32 matrix.
+        Inputs:
+            logger (Logger): A logging object for logging errors
+        Returns:
+            dict_data (dict): Column arrays "id", "qid", "question" and "answer", one entry per question
+            arr_emb (ndarray): Embeddings of shape (number of questions, embedding dimension)
+            version (int): QA bank version of the data (see getQAVersion)
+            encoder (str): encoders.encoderId of the encoder that computed the embeddings (None if not recorded)
+            False if there is an error
+    """
+    try:
+        with mysql_conn() as conn:
+            # Count and read rows from the same snapshot so the preallocated matrix fits exactly
+            cursor = conn.cursor()
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            cursor.execute(f"""SELECT COUNT(*) AS n, MAX(LENGTH(question_emb)) AS nbytes
+                               FROM {config.mysql["table-QA-emb"]}""")
+            row = cursor.fetchone()
+            # The QA bank version this snapshot corresponds to (versions commit in order, see bumpQAVersion)
+            cursor.execute(f"""SELECT version, encoder FROM {config.mysql["table-QA-version"]} WHERE id=1""")
+            row_version = cursor.fetchone()
+            cursor.close()
+            n = row["n"]
+            dim = (row["nbytes"] or 0) // EMBEDDING_DTYPE.itemsize
+
+            arr_id = np.empty(n, dtype=np.int64)
+            arr_qid = np.empty(n, dtype=np.int64)
+            arr_question = np.empty(n, dtype=object)
+            arr_answer = np.empty(n, dtype=object)
+            arr_emb = np.empty((n, dim), dtype=np.float32)
+
+            # Unbuffered cursor: rows are decoded as they arrive instead of being held in a list
+            cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+            cursor.execute(f"""SELECT id, qid, question, answer, question_emb
+                               FROM {config.mysql["table-QA-emb"]} ORDER BY id""")
+            for i, row in enumerate(cursor):
+                arr_id[i] = row["id"]
+                arr_qid[i] = row["qid"]
+                arr_question[i] = row["question"]
+                arr_answer[i] = row["answer"]
+                arr_emb[i] = decodeEmbedding(row["question_emb"])
+            cursor.close()
+            conn.commit()
+        dict_data = {"id": arr_id, "qid": arr_qid, "question": arr_question, "answer": arr_answer}
+        return dict_data, arr_emb, row_version["version"], row_version["encoder"]
+    except:
+        logger.exception("An error occurred while fetching all data from QA embedding table")
+        return False
+
+@timeDB
+def getQuestionEmbeddingByQids(
+        list_qid: List[int],
+        logger: Logger,
+    ):
+    """
+        Get the questions and embeddings of some QA pairs
+        Inputs:
+            list_qid (list): IDs of QA pairs
+            logger (Logger): A logging object for logging errors
+        Returns:
+            dict_data (dict): Column arrays "id", "qid", "question" and "answer", one entry per question
+            arr_emb (ndarray): Embeddings of shape (number of questions, embedding dimension)
+            False if there is an error
+    """
+    try:
+        list_data = []
+        if list_qid:
+            with mysql_conn() as conn:
+                placeholders = ",".join(["%s"] * len(list_qid))
+                sql = f"""SELECT id, qid, question, answer, question_emb
+                          FROM {config.mysql["table-QA-emb"]} WHERE qid IN ({placeholders}) ORDER BY id"""
+                # Create a cursor
+                cursor = conn.cursor()
+                # Execute SQL command
+                cursor.execute(sql, list_qid)
+                # Fetch all data
+                list_data = cursor.fetchall()
+                # Close the cursor
+                cursor.close()
+        dict_data = {"id": np.array([row["id"] for row in list_data], dtype=np.int64),
+                     "qid": np.array([row["qid"] for row in list_data], dtype=np.int64),
+                     "question": np.array([row["question"] for row in list_data], dtype=object),
+                     "answer": np.array([row["answer"] for row in list_data], dtype=object)}
+        arr_emb = np.array([decodeEmbedding(row["question_emb"]) for row in list_data], dtype=np.float32)
+        return dict_data, arr_emb
+    except:
+        logger.exception("An error occurred while fetching data from QA embedding table")
+        return False
+
+@timeDB
+def getQAVersion(logger: Logger):
+    """
+        Get the current QA bank version: the version of the latest committed change
+        Every write to the QA bank takes the next version (see bumpQAVersion), so the version only grows.
+        Inputs:
+            logger (Logger): A logging object for logging errors
+        Returns:
+            version (int): 0 if nothing was ever written
+            None if there is an error
+    """
+    try:
+        with mysql_conn() as conn:
+            sql = f"""SELECT version FROM {config.mysql["table-QA-version"]} WHERE id=1"""
+            # Create a cursor
+            cursor = conn.cursor()
+            # Execute SQL command
+            cursor.execute(sql)
+            version = cursor.fetchone()["version"]
+            # Close the cursor
+            cursor.close()
+        return version
+    except:
+        logger.exception("An error occurred while fetching the version of QA bank")
+        return None
+
+@timeDB
+def getQAChanges(
+        since_version: int,
+        logger: Logger,
+    ):
+    """
+        Get the change log entries after a given version
+        Inputs:
+            since_version (int): Version the caller is already up to date with
+            logger (Logger): A logging object for logging errors
+        Returns:
+            list_data (list): Dictionaries of version, qid and op ("upsert", "delete" or "clear"), oldest first
+            False if there is an error
+    """
+    try:
+        with mysql_conn() as conn:
+            sql = f"""SELECT version, qid, op FROM {config.mysql["table-QA-log"]}
+                      WHERE version > %(version)s ORDER BY version"""
+            # Create a cursor
+            cursor = conn.cursor()
+            # Execute SQL command
+            cursor.execute(sql, {"version": since_version})
+            # Fetch all data
+            list_data = cursor.fetchall()
+            # Close the cursor
+            cursor.close()
+        return list_data
+    except:
+        logger.exception("An error occurred while fetching changes of QA bank")
+        return False
+
+def bumpQAVersion(cursor, list_change, encoder=None):
+    """
+        Append changes to the QA bank change log within the caller's transaction, taking their versions
+        from the single-row version counter. The counter row stays locked until the caller commits, so
+        versions commit in the order they are taken: a worker that has seen version v has seen every
+        change up to v. Call it as the last statement before the commit, to hold the lock briefly.
+        Log entries before a clear or a reload are dropped, they are never needed again.
+        Inputs:
+            cursor (Cursor): Cursor of the transaction of the change
+            list_change (list): (qid, op) of every change, as for logQAChange
+            encoder (str): For changes that store embeddings, encoders.encoderId of their encoder, which
+                           has to be the encoder of the stored ones so that they never mix two encoders
+        Returns:
+            list_version (list): Versions of the changes, in order
+        Raises:
+            ValueError: The stored embeddings were computed by another encoder than encoder
+    """
+    if encoder is None:
+        cursor.execute(f"""UPDATE {config.mysql["table-QA-version"]} SET version=LAST_INSERT_ID(version+%(n)s) WHERE id=1""",
+                       {"n": len(list_change)})
+    else:
+        # Checked in the same statement as the bump: a shared lock taken earlier would have to be upgraded
+        if not cursor.execute(f"""UPDATE {config.mysql["table-QA-version"]} SET version=LAST_INSERT_ID(version+%(n)s)
+                                 WHERE id=1 AND (encoder IS NULL OR encoder=%(encoder)s)""",
+                              {"n": len(list_change), "encoder": encoder}):
+            raise ValueError(f"The QA bank is not embedded by encoder {encoder}")
+    cursor.execute("SELECT LAST_INSERT_ID() AS version")
+    last_version = cursor.fetchone()["version"]
+    list_version = list(range(last_version - len(list_change) + 1, last_version + 1))
+    cursor.executemany(f"""insert into {config.mysql["table-QA-log"]} (version,qid,op) values (%s,%s,%s);""",
+                       [(version, qid, op) for version, (qid, op) in zip(list_version, list_change)])
+    list_reset = [version for version, (_, op) in zip(list_version, list_change) if op in ("clear", "reload")]
+    if list_reset:
+        cursor.execute(f"""DELETE FROM {config.mysql["table-QA-log"]} WHERE version < %(version)s""",
+                       {"version": list_reset[-1]})
+    return list_version
+
+@timeDB
+def logQAChange(
+        qid: int,
+        op: str,
+        logger: Logger,
+    ):
+    """
+        Append a change to the QA bank change log, which bumps the QA bank version
+        Inputs:
+            qid (int): ID of the changed QA pair; None for "clear" and "reload"
+            op (str): "upsert" (created or updated), "delete", "clear" (all QA pairs deleted)
+                      or "reload" (too many changes to apply one by one, e.g. a bulk import)
+            logger (Logger): A logging object for logging errors
+        Returns:
+            version (int): The new QA bank version
+            None if there is an error
+    """
+    try:
+        with mysql_conn() as mysql:
+            # Create a cursor
+            cursor = mysql.cursor()
+            version = bumpQAVersion(cursor, [(qid, op)])[0]
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
+        return version
+    except:
+        logger.exception("An error occurred while inserting a change into QA change log")
+        return None
+
+
+@timeDB
 def createQuestionEmbedding(
         list_data: List[Dict],
         logger: Logger
@@ -272,7 +809,8 @@ def createQuestionEmbedding(
     """
         Insert Question embeddings
         Inputs:
-            list_data (list): A list of dictionaries of question and answers
+            list_data (list): A list of dictionaries of qid, question, answer and question_emb,
+                              where question_emb is the output of encodeEmbedding()
             logger (Logger): A logging object for logging errors
         Returns:
             True if data are successfully inserted into the table
@@ -282,7 +820,7 @@ def createQuestionEmbedding(
         with mysql_conn() as mysql:
             # SQL command for inserting new data
             sql = f"""
-                    insert into {config.mysql['table-QA']}
+                    insert into {config.mysql['table-QA-emb']}
                     (qid,question,answer,question_emb) values (%(qid)s,%(question)s,%(answer)s,%(question_emb)s);
                     """
                 
@@ -290,12 +828,16 @@ def createQuestionEmbedding(
             cursor = mysql.cursor()
             # Execute SQL command
             cursor.executemany(sql, list_data)
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
         return True
     except:
         logger.exception("An error occurred while inserting data into QA embedding table")
         return False
     
 
+@timeDB
 def deleteQuestionEmbedding(
         qid: int,
         logger: Logger
@@ -322,7 +864,253 @@ def deleteQuestionEmbedding(
             cursor = mysql.cursor()
             # Execute SQL command
             cursor.execute(sql)
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
         return True
     except:
         logger.exception("An error occurred while deleting data from QA embedding table")
-        return False
\ No newline at end of file
+        return False
+
+@timeDB
+def deleteAllQuestionEmbedding(logger: Logger):
+    """
+        Delete all question embeddings
+        Inputs:
+            logger (Logger): A logging object for logging errors
+        Returns:
+            True if the data is successfully deleted
+            False if there is an error
+    """
+    try:
+        with mysql_conn() as mysql:
+            # SQL command for deleting all data
+            sql = f"""
+                    TRUNCATE {config.mysql["table-QA-emb"]}
+                    """
+            # Create a cursor
+            cursor = mysql.cursor()
+            # Execute SQL command
+            cursor.execute(sql)
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
+        return True
+    except:
+        logger.exception("An error occurred while deleting all data from QA embedding table")
+        return False
+
+@timeDB
+def reembedQuestionAnswer(
+        encoder: str,
+        logger: Logger,
+    ):
+    """
+        Switch the QA bank to another encoder: drop every stored embedding, record the new encoder
+        and enqueue an embedding job for every QA pair, in a single transaction. The "reload" change
+        makes every worker load the bank again, which fills up as the jobs complete.
+        Inputs:
+            encoder (str): encoders.encoderId of the encoder the embedding runners now use
+            logger (Logger): A logging object for logging errors
+        Returns:
+            version (int): The new QA bank version
+            n_job (int): Number of enqueued embedding jobs
+            None if there is an error
+    """
+    try:
+        with mysql_conn() as mysql:
+            # Create a cursor
+            cursor = mysql.cursor()
+            # DELETE rather than TRUNCATE, which would commit
+            cursor.execute(f"""DELETE FROM {config.mysql["table-QA-emb"]}""")
+            n_job = cursor.execute(f"""insert into {config.mysql["table-emb-job"]} (qid)
+                                       SELECT id FROM {config.mysql["table-QA"]} ORDER BY id""")
+            cursor.execute(f"""UPDATE {config.mysql["table-QA-version"]} SET encoder=%(encoder)s WHERE id=1""",
+                           {"encoder": encoder})
+            version = bumpQAVersion(cursor, [(None, "reload")])[0]
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
+        return version, n_job
+    except:
+        logger.exception("An error occurred while switching the encoder of QA bank")
+        return None
+
+def insertEmbeddingJob(cursor, qid):
+    """
+        Enqueue the (re-)embedding of the questions of a QA pair within the caller's transaction,
+        so that the job is committed together with the QA row it embeds
+        Inputs:
+            cursor (Cursor): Cursor of the transaction of the change
+            qid (int): ID of the QA pair
+        Returns:
+            id (int): ID of the job
+    """
+    cursor.execute(f"""insert into {config.mysql["table-emb-job"]} (qid) values (%(qid)s);""", {"qid": qid})
+    return cursor.lastrowid
+
+@timeDB
+def getEmbeddingJob(
+        id: int,
+        logger: Logger,
+    ):
+    """
+        Get the status of an embedding job
+        Inputs:
+            id (int): ID of the job
+            logger (Logger): A logging object for logging errors
+        Returns:
+            data (dict): The job (None if id does not exist)
+            False if there is an error
+    """
+    try:
+        with mysql_conn() as conn:
+            sql = f"""SELECT * FROM {config.mysql["table-emb-job"]} WHERE id=%(id)s"""
+            # Create a cursor
+            cursor = conn.cursor()
+            # Execute SQL command
+            cursor.execute(sql, {"id": id})
+            data = cursor.fetchone()
+            # Close the cursor
+            cursor.close()
+        return data
+    except:
+        logger.exception("An error occurred while fetching a data from embedding job table")
+        return False
+
+@timeDB
+def claimEmbeddingJobs(
+        limit: int,
+        lease: int,
+        logger: Logger,
+    ):
+    """
+        Claim a batch of embedding jobs, together with the current questions and answer of their QA pair
+        Pending jobs that are due are claimed, and so are running jobs not finished within lease seconds
+        (their runner died). Rows locked by another runner are skipped, so runners never share a job.
+        Inputs:
+            limit (int): Maximum number of jobs
+            lease (int): Seconds a runner has to finish a job
+            logger (Logger): A logging object for logging errors
+        Returns:
+            list_job (list): A list of dictionaries of id, qid, attempts, question (JSON text, None if the
+                             QA pair was deleted) and answer
+            False if there is an error
+    """
+    try:
+        with mysql_conn() as mysql:
+            # Create a cursor
+            cursor = mysql.cursor()
+            cursor.execute(f"""SELECT id FROM {config.mysql["table-emb-job"]}
+                               WHERE (status='pending' AND available_at <= NOW())
+                                  OR (status='running' AND updated_at < NOW() - INTERVAL %(lease)s SECOND)
+                               ORDER BY id LIMIT %(limit)s FOR UPDATE SKIP LOCKED""", {"lease": lease, "limit": limit})
+            list_id = [row["id"] for row in cursor.fetchall()]
+            if not list_id:
+                mysql.commit()
+                cursor.close()
+                return []
+            cursor.execute(f"""UPDATE {config.mysql["table-emb-job"]} SET status='running', attempts=attempts+1
+                               WHERE id IN %(list_id)s""", {"list_id": list_id})
+            cursor.execute(f"""SELECT job.id, job.qid, job.attempts, qa.question, qa.answer
+                               FROM {config.mysql["table-emb-job"]} AS job
+                               LEFT JOIN {config.mysql["table-QA"]} AS qa ON qa.id = job.qid
+                               WHERE job.id IN %(list_id)s ORDER BY job.id""", {"list_id": list_id})
+            list_job = cursor.fetchall()
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
+        return list_job
+    except:
+        logger.exception("An error occurred while claiming embedding jobs")
+        return False
+
+@timeDB
+def completeEmbeddingJobs(
+        list_result: List[Dict],
+        logger: Logger,
+    ):
+    """
+        Store the embeddings computed by claimed jobs and mark the jobs done, in a single transaction
+        A QA pair changed since its job was claimed is left to its newer job; a deleted one needs nothing.
+        Inputs:
+            list_result (list): A list of dictionaries, one per QA pair, of job (the latest of its jobs, as
+                                returned by claimEmbeddingJobs), list_id (IDs of all its claimed jobs),
+                                questions (list of normalized questions) and question_emb (embeddings)
+            logger (Logger): A logging object for logging errors
+        Returns:
+            list_version (list): For every result, the QA bank version of its change, or None if it was not applied
+            None if there is an error
+    """
+    try:
+        with mysql_conn() as mysql:
+            # Create a cursor
+            cursor = mysql.cursor()
+            list_applied = []
+            for result in list_result:
+                job = result["job"]
+                # Lock the QA pair so it cannot change between the check and the insert
+                cursor.execute(f"""SELECT question, answer FROM {config.mysql["table-QA"]} WHERE id=%(qid)s FOR UPDATE""",
+                               {"qid": job["qid"]})
+                row = cursor.fetchone()
+                applied = False
+                if row is not None and (json.loads(row["question"]), row["answer"]) == (json.loads(job["question"]), job["answer"]):
+                    cursor.execute(f"""DELETE FROM {config.mysql["table-QA-emb"]} WHERE qid=%(qid)s""", {"qid": job["qid"]})
+                    cursor.executemany(f"""
+                            insert into {config.mysql["table-QA-emb"]}
+                            (qid,question,answer,question_emb) values (%s,%s,%s,%s);
+                            """, [(job["qid"], question, job["answer"], encodeEmbedding(emb))
+                                  for question, emb in zip(result["questions"], result["question_emb"])])
+                    applied = True
+                cursor.execute(f"""UPDATE {config.mysql["table-emb-job"]} SET status='done', error=NULL
+                                   WHERE id IN %(list_id)s""", {"list_id": result["list_id"]})
+                list_applied.append(applied)
+            # Bump the QA bank version once per stored QA pair so that the workers pick up the changes,
+            # last, so that the version counter is locked only for the commit
+            list_change = [(result["job"]["qid"], "upsert") for result, applied in zip(list_result, list_applied) if applied]
+            iter_version = iter(bumpQAVersion(cursor, list_change, encoder=encoderId()) if list_change else [])
+            list_version = [next(iter_version) if applied else None for applied in list_applied]
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
+        return list_version
+    except:
+        logger.exception("An error occurred while completing embedding jobs")
+        return None
+
+@timeDB
+def failEmbeddingJobs(
+        list_job: List[Dict],
+        error: str,
+        logger: Logger,
+    ):
+    """
+        Put failed jobs back in the queue with an exponential backoff, or mark them failed after
+        config.embedding_jobs["max_attempts"] attempts
+        Inputs:
+            list_job (list): Jobs as returned by claimEmbeddingJobs
+            error (str): Error message recorded in the jobs
+            logger (Logger): A logging object for logging errors
+        Returns:
+            True if the jobs are updated
+            False if there is an error
+    """
+    try:
+        with mysql_conn() as mysql:
+            # Create a cursor
+            cursor = mysql.cursor()
+            list_data = [{"id": job["id"],
+                          "status": "failed" if job["attempts"] >= config.embedding_jobs["max_attempts"] else "pending",
+                          "delay": config.embedding_jobs["retry_delay"] * 2 ** (job["attempts"] - 1),
+                          "error": error}
+                         for job in list_job]
+            cursor.executemany(f"""UPDATE {config.mysql["table-emb-job"]}
+                                   SET status=%(status)s, error=%(error)s, available_at=NOW() + INTERVAL %(delay)s SECOND
+                                   WHERE id=%(id)s""", list_data)
+            mysql.commit()
+            # Close the cursor
+            cursor.close()
+        return True
+    except:
+        logger.exception("An error occurred while updating failed embedding jobs")
+        return False
@@ -0,0 +1,193 @@
+from logging import Logger
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from .. import config
+
+_redis = None
+_redis_pid = None
+
+def getRedis():
+    """
+        Return the Redis client of this process (redis.asyncio), creating it on first use
+        (and again in a forked child, which must not share its parent's sockets)
+    """
+    global _redis, _redis_pid
+    if _redis is None or _redis_pid != os.getpid():
+        import redis.asyncio
+        from redis.asyncio.retry import Retry
+        from redis.backoff import NoBackoff
+        host, port = config.aioredis_redis["address"]
+        # No retries: callers fall back to something else rather than wait for Redis
+        _redis = redis.asyncio.Redis(host=host, port=port, password=config.aioredis_redis["password"],
+                                     socket_timeout=config.aioredis_redis["timeout"],
+                                     socket_connect_timeout=config.aioredis_redis["timeout"],
+                                     retry=Retry(NoBackoff(), 0))
+        _redis_pid = os.getpid()
+    return _redis
+
+async def callRedis(method, *args, **kwargs):
+    """
+        Call a method of the Redis client, giving up after config.aioredis_redis["timeout"] seconds
+        (which also bounds connecting, including name resolution)
+        Inputs:
+            method (str): Name of the redis.asyncio.Redis method, e.g. "get"
+            args, kwargs: Arguments of the method
+    """
+    return await asyncio.wait_for(getattr(getRedis(), method)(*args, **kwargs), config.aioredis_redis["timeout"])
+
+class LocalTTLStore:
+    """
+        In-process stand-in for Redis keys with a TTL: an LRU dict bounded by max_items
+    """
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._data = OrderedDict()  # key -> (expiry time, value)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item[1]
+
+    def set(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+class RedisStore:
+    """
+        JSON values in Redis under a key prefix, with a TTL.
+        If Redis is unreachable (or backend is "local"), this worker keeps the values in memory instead
+        and retries Redis after config.aioredis_redis["retry_interval"] seconds.
+    """
+    def __init__(self, logger: Logger, backend, prefix, ttl, local_max):
+        self.logger = logger
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local = LocalTTLStore(local_max)
+        self._redis_down_until = 0.0
+
+    def _useRedis(self):
+        return self.backend == "redis" and time.monotonic() >= self._redis_down_until
+
+    def _redisFailed(self):
+        if time.monotonic() >= self._redis_down_until:
+            self.logger.exception(f"Redis is unreachable, keeping {self.prefix}* in memory for now")
+        self._redis_down_until = time.monotonic() + config.aioredis_redis["retry_interval"]
+
+    async def get(self, key):
+        """
+            Returns:
+                The value of key, or None if there is no live value
+        """
+        if self._useRedis():
+            try:
+                value = await callRedis("get", self.prefix + key)
+                return json.loads(value) if value is not None else None
+            except Exception:
+                self._redisFailed()
+        return self.local.get(key)
+
+    async def set(self, key, value):
+        """
+            Save a value, resetting its TTL
+        """
+        if self._useRedis():
+            try:
+                await callRedis("set", self.prefix + key, json.dumps(value), ex=self.ttl)
+                return
+            except Exception:
+                self._redisFailed()
+        self.local.set(key, value, self.ttl)
+
+    async def delete(self, key):
+        # Also dropped locally, in case it was saved there while Redis was down
+        self.local.delete(key)
+        if self._useRedis():
+            try:
+                await callRedis("delete", self.prefix + key)
+            except Exception:
+                self._redisFailed()
+
+class SessionStore(RedisStore):
+    """
+        Conversation sessions keyed by uid: {"state": str, "qids": list of int}, the state of the dialogue
+        and the candidate qids offered to the user. Sessions live in Redis, shared by all workers,
+        and expire after config.session["ttl"] seconds of inactivity.
+    """
+    def __init__(self, logger: Logger):
+        super().__init__(logger, config.session["backend"], config.session["prefix"],
+                         config.session["ttl"], config.session["local_max"])
+
+class ResponseCache(RedisStore):
+    """
+        Results of /chatbot/ask for a normalized question, keyed by the QA bank version they were computed at,
+        so that every change of the QA bank invalidates them.
+        Entries are kept in memory (LRU with TTL) and, with the "redis" backend, also shared by all workers.
+    """
+    def __init__(self, logger: Logger):
+        super().__init__(logger, config.response_cache["backend"], config.response_cache["prefix"],
+                         config.response_cache["ttl"], config.response_cache["local_max"])
+        self.version = None
+
+    def _checkVersion(self, version):
+        # Entries of older versions are never hit again
+        if version != self.version:
+            self.local.clear()
+            self.version = version
+
+    async def get(self, text, version):
+        """
+            Inputs:
+                text (str): Normalized question
+                version (int): QA bank version of the in-memory data
+            Returns:
+                result (dict), or None on a miss
+        """
+        self._checkVersion(version)
+        key = f"{version}:{text}"
+        result = self.local.get(key)
+        if result is None and self._useRedis():
+            try:
+                value = await callRedis("get", self.prefix + key)
+            except Exception:
+                self._redisFailed()
+                return None
+            if value is not None:
+                result = json.loads(value)
+                self.local.set(key, result, self.ttl)
+        return result
+
+    async def set(self, text, version, result):
+        """
+            Save the result computed for a normalized question at a QA bank version
+        """
+        self._checkVersion(version)
+        key = f"{version}:{text}"
+        self.local.set(key, result, self.ttl)
+        if self._useRedis():
+            try:
+                await callRedis("set", self.prefix + key, json.dumps(result), ex=self.ttl)
+            except Exception:
+                self._redisFailed()
+
+    def clear(self):
+        """
+            Drop the entries kept in memory (e.g. after a change of the data that did not advance the version)
+        """
+        self.local.clear()
@@ -0,0 +1,162 @@
+# Background embedding of QA pairs written through /manage/QA.
+# createQA/updateQA commit the QA row together with a job (table config.mysql["table-emb-job"]) instead of
+# running the encoder inside the request. Runners claim due jobs in batches (SELECT ... FOR UPDATE
+# SKIP LOCKED, so several runners never take the same job), encode the current questions of their
+# QA pairs together, store the embeddings, and log an "upsert" change that every worker syncs.
+# Failed jobs are retried with an exponential backoff (see mysql_funcs.failEmbeddingJobs).
+#
+# EMBEDDING_RUNNER=app (default): every app worker runs jobs in one background thread
+# EMBEDDING_RUNNER=process: app workers only enqueue; run `python -m app.embedding_jobs` separately
+# so that admin encoding bursts never compete with /chatbot/ask for CPU
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import config
+from .database.mysql_funcs import claimEmbeddingJobs, completeEmbeddingJobs, failEmbeddingJobs
+from .model_func import get_model
+
+def processJobs(model, logger, limit=config.embedding_jobs["batch_size"]):
+    """
+        Claim a batch of due jobs, embed their QA pairs and store the embeddings (blocking)
+        Inputs:
+            model: Encoder with an encode_batch method (model_func.SentenceBert)
+            logger (Logger): A logging object for logging errors
+            limit (int): Maximum number of jobs
+        Returns:
+            list_applied (list): (qid, questions, answer, embeddings, version) of every QA pair whose
+                                 embeddings were stored, in the order of their versions
+            None if no job could be claimed (none due, or a database error)
+    """
+    list_job = claimEmbeddingJobs(limit, config.embedding_jobs["lease"], logger)
+    if not list_job:
+        return None
+
+    # A QA pair updated several times is embedded once, with its current content
+    dict_result = {}
+    for job in list_job:
+        result = dict_result.setdefault(job["qid"], {"list_id": []})
+        result["list_id"].append(job["id"])
+        result["job"] = job
+    list_result = list(dict_result.values())
+    try:
+        for result in list_result:
+            job = result["job"]
+            result["questions"] = json.loads(job["question"]) if job["question"] is not None else []
+        list_text = [q for result in list_result for q in result["questions"]]
+        arr_emb = model.encode_batch(list_text) if list_text else None
+    except Exception as e:
+        logger.exception("An error occurred while embedding QA pairs of embedding jobs")
+        failEmbeddingJobs(list_job, repr(e), logger)
+        return []
+    # Split the rows back per QA pair
+    start = 0
+    for result in list_result:
+        result["question_emb"] = arr_emb[start:start + len(result["questions"])] if arr_emb is not None else []
+        start += len(result["questions"])
+
+    list_version = completeEmbeddingJobs(list_result, logger)
+    if list_version is None:
+        failEmbeddingJobs(list_job, "An error occurred while completing embedding jobs", logger)
+        return []
+    logger.info(f"Completed {len(list_job)} embedding jobs")
+    return [(result["job"]["qid"], result["questions"], result["job"]["answer"], result["question_emb"], version)
+            for result, version in zip(list_result, list_version) if version is not None]
+
+class EmbeddingJobRunner:
+    """
+        Runs embedding jobs in the background of an app worker, in one dedicated thread.
+        It wakes up when this worker enqueues a job, and otherwise every config.embedding_jobs["poll_interval"]
+        seconds to pick up jobs enqueued by other workers or due for a retry.
+        on_applied is called on the event loop for every batch of stored QA pairs, with the list returned by processJobs.
+    """
+    def __init__(self, logger, on_applied=None):
+        self.logger = logger
+        self.on_applied = on_applied
+        self._task = None
+        self._event = None
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-jobs")
+
+    def start(self):
+        """
+            Start the polling loop on the running event loop
+        """
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._event = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # wait_for (Python < 3.12) swallows a cancellation that arrives as the event is set,
+            # so the loop also checks _stopping
+            self._stopping = True
+            self._event.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    def wake(self):
+        """
+            Process jobs now rather than at the next poll
+        """
+        if self._event is not None:
+            self._event.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        model = None
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._event.wait(), config.embedding_jobs["poll_interval"])
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+            if self._stopping:
+                break
+            try:
+                if model is None:
+                    model = await loop.run_in_executor(self._executor, get_model)
+                # Keep going while there are full batches of due jobs
+                while True:
+                    list_applied = await loop.run_in_executor(self._executor, processJobs, model, self.logger)
+                    if list_applied is None:
+                        break
+                    if self.on_applied is not None and list_applied:
+                        self.on_applied(list_applied)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception("An error occurred while running embedding jobs")
+
+def runForever(logger, stop_event=None):
+    """
+        Process jobs until stop_event is set, sleeping config.embedding_jobs["poll_interval"] seconds
+        whenever no job is due (used by the standalone runner)
+    """
+    model = get_model()
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            if processJobs(model, logger) is None:
+                stop_event.wait(config.embedding_jobs["poll_interval"])
+        except Exception:
+            logger.exception("An error occurred while running embedding jobs")
+            stop_event.wait(config.embedding_jobs["poll_interval"])
+
+if __name__ == "__main__":
+    # Standalone runner for EMBEDDING_RUNNER=process; app workers pick up the stored embeddings
+    # through the QA change log (syncData)
+    from . import logger as app_logger
+    logger_jobs = app_logger.setForWritefile("embedding_jobs", "app/logs/embedding_jobs.log")
+    list_thread = [threading.Thread(target=runForever, args=(logger_jobs,), name=f"embedding-jobs-{i}")
+                   for i in range(config.embedding_jobs["process_threads"])]
+    for thread in list_thread:
+        thread.start()
+    for thread in list_thread:
+        thread.join()
@@ -0,0 +1,178 @@
+# Encoder backends behind model_func.SentenceBert, selected by config.encoder_model["backend"]:
+#   sentence-transformers: SentenceTransformer with default PyTorch settings (the reference)
+#   int8: the same model on CPU with its Linear layers dynamically quantized to int8
+#   onnx: an exported model run by ONNX Runtime from a local directory (model.onnx and tokenizer.json),
+#         with the mean pooling and normalization of the sentence-transformers model
+#   hashing: deterministic feature hashing without any model, for tests and benchmarks
+# Every backend subclasses Encoder: encode(list_text, batch_size=32) returns float32 embeddings of shape
+# (n, dim), like SentenceTransformer.encode. Compare them with benchmarks/bench_encoders.py.
+# Embeddings of different backends or models are not comparable: the stored ones are tagged with the
+# encoderId that computed them, and a worker whose encoder differs refuses to load them.
+import abc
+import os
+import zlib
+import numpy as np
+from . import config
+
+BACKENDS = ("sentence-transformers", "int8", "onnx", "hashing")
+
+class Encoder(abc.ABC):
+    """
+        Base class of every backend: batches the texts and calls _encode on each batch
+        Backends whose model batches the texts itself (SentenceTransformer) override encode instead.
+    """
+    dim = None
+
+    def encode(self, list_text, batch_size=32, convert_to_tensor=False):
+        if convert_to_tensor:
+            raise ValueError(f"{type(self).__name__} does not return tensors")
+        single = isinstance(list_text, str)
+        list_text = [list_text] if single else list(list_text)
+        if len(list_text) == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        arr_emb = np.concatenate([self._encode(list_text[start:start + batch_size])
+                                  for start in range(0, len(list_text), batch_size)])
+        return arr_emb[0] if single else arr_emb
+
+    @abc.abstractmethod
+    def _encode(self, list_text):
+        """
+            Embeddings of one batch of texts, float32 of shape (len(list_text), dim)
+        """
+
+class SentenceTransformerEncoder(Encoder):
+    """
+        SentenceTransformer as it is, with default PyTorch settings
+    """
+    def __init__(self, model_name=config.model_name, num_threads=config.encoder_model["num_threads"], device=None):
+        # Imported here so that the other backends do not load torch
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device=device)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, list_text, batch_size=32, convert_to_tensor=False):
+        # SentenceTransformer sorts the texts by length before batching them, which Encoder.encode would defeat
+        arr_emb = self.model.encode(list_text, batch_size=batch_size, convert_to_tensor=convert_to_tensor)
+        return arr_emb if convert_to_tensor else np.asarray(arr_emb, dtype=np.float32)
+
+    def _encode(self, list_text):
+        return self.encode(list_text, batch_size=len(list_text))
+
+class QuantizedEncoder(SentenceTransformerEncoder):
+    """
+        SentenceTransformer on CPU with dynamic int8 quantization of its Linear layers
+        (weights stored in int8, activations quantized on the fly): a smaller and faster forward
+        pass on CPU for a small loss of accuracy, without any export step
+    """
+    def __init__(self, model_name=config.model_name, num_threads=config.encoder_model["num_threads"]):
+        super().__init__(model_name, num_threads, device="cpu")
+        import torch
+        self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class OnnxEncoder(Encoder):
+    """
+        A sentence-transformers model exported to ONNX, e.g. by
+        `optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 <model_dir>`
+        The output token embeddings are mean pooled over the attention mask and L2-normalized,
+        as the modules of all-MiniLM-L6-v2 do. An exported model that already outputs sentence
+        embeddings (2-D) is used as it is.
+        Inputs:
+            model_dir (str): Directory holding the ONNX file and tokenizer.json
+            onnx_file (str): Name of the ONNX file (e.g. a quantized model_quantized.onnx)
+            num_threads (int): Intra-op threads of ONNX Runtime (0: one per physical core)
+            max_length (int): Texts are truncated to this many tokens
+            normalize (bool): L2-normalize the embeddings
+    """
+    def __init__(self, model_dir=config.encoder_model["model_dir"], onnx_file=config.encoder_model["onnx_file"],
+                 num_threads=config.encoder_model["num_threads"], max_length=config.encoder_model["max_length"],
+                 normalize=True):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, onnx_file), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.normalize = normalize
+
+    def _encode(self, list_text):
+        list_encoding = self.tokenizer.encode_batch(list_text)
+        arr_mask = np.array([e.attention_mask for e in list_encoding], dtype=np.int64)
+        inputs = {"input_ids": np.array([e.ids for e in list_encoding], dtype=np.int64),
+                  "attention_mask": arr_mask,
+                  "token_type_ids": np.array([e.type_ids for e in list_encoding], dtype=np.int64)}
+        output = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        if output.ndim == 3:
+            # Mean pooling over the real tokens
+            mask = arr_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            output = output / np.clip(np.linalg.norm(output, axis=1, keepdims=True), 1e-12, None)
+        self.dim = output.shape[1]
+        return output.astype(np.float32, copy=False)
+
+class HashingEncoder(Encoder):
+    """
+        Deterministic stand-in for a sentence encoder: signed feature hashing of words and
+        character trigrams, so paraphrases sharing words get similar embeddings
+        Inputs:
+            dim (int): Embedding dimension
+    """
+    def __init__(self, dim=config.encoder_model["hashing_dim"]):
+        self.dim = dim
+
+    def _embed(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        list_feature = text.split() + [text[i:i + 3] for i in range(max(len(text) - 2, 0))]
+        for feature in list_feature:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _encode(self, list_text):
+        return np.stack([self._embed(text) for text in list_text])
+
+def encoderId(backend=config.encoder_model["backend"], model_name=config.model_name):
+    """
+        Identifier of the embeddings computed by the encoder of a backend, stored with the QA bank
+        Inputs:
+            backend (str): One of BACKENDS
+            model_name (str): SentenceTransformer model of the sentence-transformers and int8 backends
+        Returns:
+            encoder_id (str): "<backend>:<model>", e.g. "sentence-transformers:all-MiniLM-L6-v2" or "hashing:384"
+    """
+    if backend == "onnx":
+        model = f"{os.path.basename(os.path.normpath(config.encoder_model['model_dir']))}/{config.encoder_model['onnx_file']}"
+    elif backend == "hashing":
+        model = str(config.encoder_model["hashing_dim"])
+    else:
+        model = model_name
+    return f"{backend}:{model}"
+
+def createEncoder(backend=config.encoder_model["backend"], model_name=config.model_name):
+    """
+        Load the encoder of a backend
+        Inputs:
+            backend (str): One of BACKENDS
+            model_name (str): SentenceTransformer model of the sentence-transformers and int8 backends
+                              (the onnx backend reads config.encoder_model["model_dir"] instead)
+        Returns:
+            encoder (Encoder): The encoder, with encode(list_text, batch_size=32)
+    """
+    if backend == "sentence-transformers":
+        return SentenceTransformerEncoder(model_name)
+    elif backend == "int8":
+        return QuantizedEncoder(model_name)
+    elif backend == "onnx":
+        return OnnxEncoder()
+    elif backend == "hashing":
+        return HashingEncoder()
+    raise ValueError(f"Unknown encoder backend {backend}, expected one of {BACKENDS}")
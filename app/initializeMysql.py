@@ -1,6 +1,9 @@
 from . import config
 from contextlib import contextmanager
+import json
 import pymysql
+from .database.mysql_funcs import encodeEmbedding
+from .encoders import encoderId
 
 # Used for the first time when the database is not created yet.
 # For other circumstances, use mysql_conn() from mysql_funcs.py
@@ -73,10 +76,109 @@ with mysql_conn() as db:
                     qid BIGINT NOT NULL,
                     question TEXT NOT NULL,
                     answer TEXT NOT NULL,
-                    question_emb JSON NOT NULL
+                    question_emb BLOB NOT NULL
                     )"""
             cursor.execute(sql)
             print(f"table: {table} created successfully.")
         else :
             print(f"table: {table} created unsuccessfully.")
 
+    # Create a table: QA change log (its latest version is the QA bank version)
+    table_log = config.mysql["table-QA-log"]
+    print(f"set up table : {table_log}")
+    try:
+        cursor.execute(f"SELECT 1 FROM {table_log} LIMIT 1;")
+        print(f"table {table_log} exists.")
+    except pymysql.err.ProgrammingError as e:
+        if e.args[0] == 1146:
+            print(e.args)
+            # sql for create table
+            sql = f"""CREATE TABLE {table_log} (
+                    version BIGINT NOT NULL,
+                    PRIMARY KEY (version),
+                    qid BIGINT NULL,
+                    op VARCHAR(10) NOT NULL
+                    )"""
+            cursor.execute(sql)
+            print(f"table: {table_log} created successfully.")
+        else :
+            print(f"table: {table_log} created unsuccessfully.")
+
+    # Create a table: QA bank version counter (one row; writes take versions from it in commit order),
+    # which also records the encoder that computed the stored embeddings
+    table_version = config.mysql["table-QA-version"]
+    print(f"set up table : {table_version}")
+    try:
+        cursor.execute(f"SELECT 1 FROM {table_version} LIMIT 1;")
+        print(f"table {table_version} exists.")
+    except pymysql.err.ProgrammingError as e:
+        if e.args[0] == 1146:
+            print(e.args)
+            # sql for create table
+            sql = f"""CREATE TABLE {table_version} (
+                    id TINYINT NOT NULL,
+                    PRIMARY KEY (id),
+                    version BIGINT NOT NULL,
+                    encoder VARCHAR(255) NULL
+                    )"""
+            cursor.execute(sql)
+            # Continue from the change log of an existing database, whose embeddings were computed by the configured encoder
+            cursor.execute(f"""INSERT INTO {table_version} (id, version, encoder)
+                               SELECT 1, COALESCE(MAX(version), 0), %s FROM {table_log}""", (encoderId(),))
+            db.commit()
+            print(f"table: {table_version} created successfully.")
+        else :
+            print(f"table: {table_version} created unsuccessfully.")
+
+    # Create a table: embedding jobs of admin writes (questions are embedded in the background)
+    table_job = config.mysql["table-emb-job"]
+    print(f"set up table : {table_job}")
+    try:
+        cursor.execute(f"SELECT 1 FROM {table_job} LIMIT 1;")
+        print(f"table {table_job} exists.")
+    except pymysql.err.ProgrammingError as e:
+        if e.args[0] == 1146:
+            print(e.args)
+            # sql for create table
+            sql = f"""CREATE TABLE {table_job} (
+                    id BIGINT NOT NULL AUTO_INCREMENT,
+                    PRIMARY KEY (id),
+                    qid BIGINT NOT NULL,
+                    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+                    attempts INT NOT NULL DEFAULT 0,
+                    error TEXT NULL,
+                    available_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX (status, available_at)
+                    )"""
+            cursor.execute(sql)
+            print(f"table: {table_job} created successfully.")
+        else :
+            print(f"table: {table_job} created unsuccessfully.")
+
+    # Migrate question_emb from JSON text to raw float32 bytes (BLOB)
+    cursor.execute("""SELECT DATA_TYPE FROM information_schema.COLUMNS
+                      WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s AND COLUMN_NAME='question_emb'""",
+                   (config.mysql["database"], table))
+    column = cursor.fetchone()
+    if column is not None and column["DATA_TYPE"].lower() == "json":
+        print(f"migrate {table}.question_emb from JSON to BLOB")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN question_emb_bin BLOB NULL")
+        batch_size = 1000
+        last_id = 0
+        while True:
+            cursor.execute(f"""SELECT id, question_emb FROM {table}
+                              WHERE id > %s ORDER BY id LIMIT %s""", (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            list_data = [(encodeEmbedding(json.loads(row["question_emb"])), row["id"]) for row in rows]
+            cursor.executemany(f"UPDATE {table} SET question_emb_bin=%s WHERE id=%s", list_data)
+            db.commit()
+            last_id = rows[-1]["id"]
+            print(f"migrated {table} rows up to id {last_id}")
+        cursor.execute(f"ALTER TABLE {table} DROP COLUMN question_emb")
+        cursor.execute(f"ALTER TABLE {table} CHANGE COLUMN question_emb_bin question_emb BLOB NOT NULL")
+        print(f"migrate {table}.question_emb done")
+
@@ -0,0 +1,130 @@
+# Approximate nearest-neighbour search for large question banks: an inverted-file (IVF) index.
+# Rows are clustered with spherical k-means; a query only visits the rows of its n_probe
+# closest clusters, and that shortlist is re-scored exactly against the full-precision rows.
+import os
+import tempfile
+import numpy as np
+from .model_func import normalize_rows, top_k_indices
+
+def _assign(rows, centroids, chunk_size=65536):
+    """
+        Index of the closest centroid (largest dot product) for every row, computed in chunks
+    """
+    assignments = np.empty(rows.shape[0], dtype=np.int32)
+    for start in range(0, rows.shape[0], chunk_size):
+        assignments[start:start + chunk_size] = np.argmax(rows[start:start + chunk_size] @ centroids.T, axis=1)
+    return assignments
+
+def kmeans(rows, n_lists, n_iter=10, sample_size=None, seed=0):
+    """
+        Spherical k-means over L2-normalized rows
+        Inputs:
+            rows (ndarray): L2-normalized rows of shape (n, dim)
+            n_lists (int): Number of centroids
+            n_iter (int): Number of Lloyd iterations
+            sample_size (int): Train on at most this many random rows (default 64 per centroid)
+            seed (int): Random seed, so that every build of the same data gives the same centroids
+        Returns:
+            centroids (ndarray): L2-normalized centroids of shape (n_lists, dim)
+    """
+    rng = np.random.default_rng(seed)
+    n = rows.shape[0]
+    sample_size = sample_size or 64 * n_lists
+    sample = rows[rng.choice(n, size=min(n, sample_size), replace=False)] if n > sample_size else np.asarray(rows)
+    centroids = sample[rng.choice(sample.shape[0], size=n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        # Re-seed empty clusters with random rows
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+class IVFIndex:
+    """
+        Inverted lists over the rows of a QuestionIndex.
+        Only the centroids and the cluster of every row are stored; the rows themselves stay
+        in the QuestionIndex, which also does the exact re-scoring.
+    """
+    def __init__(self, centroids, assignments):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self._order = None
+        self._offsets = None
+
+    @classmethod
+    def build(cls, rows, n_lists=0, n_iter=10, seed=0):
+        """
+            Inputs:
+                rows (ndarray): L2-normalized rows of shape (n, dim)
+                n_lists (int): Number of clusters; 0 picks about sqrt(n)
+        """
+        n = rows.shape[0]
+        n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+        centroids = kmeans(rows, n_lists, n_iter=n_iter, seed=seed)
+        return cls(centroids, _assign(rows, centroids))
+
+    def __len__(self):
+        return self.assignments.shape[0]
+
+    def _lists(self):
+        # Rows grouped by cluster: the rows of cluster c are order[offsets[c]:offsets[c + 1]]
+        if self._order is None:
+            self._order = np.argsort(self.assignments, kind="stable")
+            self._offsets = np.zeros(self.centroids.shape[0] + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.assignments, minlength=self.centroids.shape[0]), out=self._offsets[1:])
+        return self._order, self._offsets
+
+    def shortlist(self, query, n_probe):
+        """
+            Row indices of the n_probe clusters closest to a normalized query
+        """
+        order, offsets = self._lists()
+        probes = top_k_indices(self.centroids @ query, n_probe)
+        return np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes])
+
+    def add(self, rows):
+        """
+            Assign appended rows to their closest cluster (centroids are not retrained)
+        """
+        self.assignments = np.concatenate([self.assignments, _assign(rows, self.centroids)])
+        self._order = None
+
+    def remove(self, keep):
+        """
+            Drop removed rows; keep is the boolean mask returned by QuestionIndex.remove()
+        """
+        self.assignments = self.assignments[keep]
+        self._order = None
+
+    def save(self, path, version):
+        """
+            Write centroids and assignments atomically, tagged with the QA bank version they index
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".qa_ivf-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, centroids=self.centroids, assignments=self.assignments, version=np.int64(version))
+            os.replace(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, version, n_rows):
+        """
+            Load a saved index if it matches the QA bank version and number of rows; None otherwise
+        """
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != version or data["assignments"].shape[0] != n_rows:
+                    return None
+                return cls(data["centroids"], data["assignments"])
+        except (OSError, KeyError, ValueError):
+            return None
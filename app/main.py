@@ -1,4 +1,5 @@
-from fastapi import FastAPI  #APIRouter, Body, Query, Path, Request
+from fastapi import FastAPI, Response  #APIRouter, Body, Query, Path, Request
+import gc
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,6 +10,8 @@ from fastapi.openapi.docs import (
 )
 from . import config
 from . import logger
+from . import metrics
+from . import profiling
 from .routers import QA_manage, chatbotAPI
 
 logger_main = logger.setForWritefile("main", "app/logs/main.log")
@@ -24,6 +27,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Request durations for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+# Sampled cProfile captures of /chatbot/ask and /manage/* while profiling is on
+app.add_middleware(profiling.ProfilingMiddleware, logger=logger_main)
 
 app.mount("/static", StaticFiles(directory="./app/static"), name="static")
 
@@ -49,6 +56,23 @@ async def redoc_html():
         title=app.title + " - ReDoc",
         redoc_js_url="/static/redoc.standalone.js",
     )
+
+@app.get("/ready", include_in_schema=False)
+def readiness(response: Response):
+    """
+        Readiness probe: 503 until this worker has loaded the QA data and warmed up its encoder
+    """
+    if not chatbotAPI.ready:
+        response.status_code = 503
+    return {"ready": chatbotAPI.ready}
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """
+        Prometheus metrics of all workers
+    """
+    data, content_type = metrics.render()
+    return Response(content=data, media_type=content_type)
     
 # API for chatbot service
 app.include_router(
@@ -59,6 +83,12 @@ app.include_router(
 # API for QA management 
 app.include_router(
     QA_manage.router,
-    prefix="/manage/",
+    prefix="/manage",
     tags=["QA_manage"],
 )
+
+if config.preload_app:
+    # Runs once in the gunicorn master: load what the workers will share, then keep the garbage
+    # collector from touching (and so copying) those objects in the workers
+    chatbotAPI.preload()
+    gc.freeze()
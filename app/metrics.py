@@ -0,0 +1,94 @@
+# Prometheus metrics of the chatbot, exposed by GET /metrics.
+# Under gunicorn every worker is a separate process: set PROMETHEUS_MULTIPROC_DIR (gunicorn_conf.py
+# does) so that each worker writes its samples to that directory and /metrics, whichever worker
+# serves it, aggregates all of them.
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HTTP_REQUEST_SECONDS = Histogram("chatbot_http_request_seconds", "Duration of HTTP requests",
+                                 ["method", "path"], buckets=LATENCY_BUCKETS)
+ASK_STAGE_SECONDS = Histogram("chatbot_ask_stage_seconds", "Duration of each stage of /chatbot/ask",
+                              ["stage"], buckets=LATENCY_BUCKETS)
+DB_CALL_SECONDS = Histogram("chatbot_db_call_seconds", "Duration of MySQL functions in mysql_funcs",
+                            ["function"], buckets=LATENCY_BUCKETS)
+ENCODER_BATCH_SIZE = Histogram("chatbot_encoder_batch_size", "Texts per micro-batch of the ask encoder",
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+EMBEDDING_CACHE_REQUESTS = Counter("chatbot_embedding_cache_requests_total", "Embedding cache lookups",
+                                   ["result"])
+EMBEDDING_CACHE_HITS = EMBEDDING_CACHE_REQUESTS.labels("hit")
+EMBEDDING_CACHE_MISSES = EMBEDDING_CACHE_REQUESTS.labels("miss")
+RESPONSE_CACHE_REQUESTS = Counter("chatbot_response_cache_requests_total", "Response cache lookups of /chatbot/ask",
+                                  ["result"])
+RESPONSE_CACHE_HITS = RESPONSE_CACHE_REQUESTS.labels("hit")
+RESPONSE_CACHE_MISSES = RESPONSE_CACHE_REQUESTS.labels("miss")
+# One sample per live worker (pid label), so a worker lagging behind the others is visible
+INDEX_QUESTIONS = Gauge("chatbot_index_questions", "Questions in the in-memory index of a worker",
+                        multiprocess_mode="liveall")
+INDEX_VERSION = Gauge("chatbot_index_version", "QA bank version the in-memory index of a worker reflects",
+                      multiprocess_mode="liveall")
+
+@contextmanager
+def timeStage(stage):
+    """
+        Observe the duration of a block as one stage of /chatbot/ask
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ASK_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def timeDB(func):
+    """
+        Decorator observing the duration of a mysql_funcs function
+    """
+    histogram = DB_CALL_SECONDS.labels(func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+class MetricsMiddleware:
+    """
+        ASGI middleware observing the duration of every HTTP request, labelled with its route template
+        (e.g. /manage/QA/{id}) rather than the raw path, so the number of series stays bounded
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The router stores the matched route in the scope; recent FastAPI versions keep routes of
+            # included routers unprefixed there and record the full path in their own route context
+            context = scope.get("fastapi", {}).get("effective_route_context")
+            path = getattr(context, "path", None) or getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path).observe(time.perf_counter() - start)
+
+def render():
+    """
+        Current metrics in the Prometheus text format, aggregated over all workers when running multi-process
+        Returns:
+            data (bytes), content_type (str)
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,20 +1,723 @@
-import functools
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from . import config
+from . import metrics
+from . import profiling
+from .encoders import createEncoder
+
+def normalize_text(text):
+    """
+        Normalize a question the same way for the question bank and for user input
+    """
+    text = text.lower().strip()
+    # Remove some punctuations
+    for punc in ["?", "？", "!", "！"]:
+        if punc in text:
+            text = text.replace(punc, "")
+    # Replace some punctuations
+    for punc, punc_new in {",": "，", "(": "（", ")": "）"}.items():
+        if punc in text:
+            text = text.replace(punc, punc_new)
+    return text
+
+class EmbeddingCache:
+    """
+        Thread-safe LRU cache from normalized text to its embedding.
+        Bounded both by number of entries and by the bytes held in embeddings.
+    """
+    def __init__(self, max_items=config.embedding_cache_size, max_bytes=config.embedding_cache_max_bytes):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, text):
+        with self._lock:
+            emb = self._data.get(text)
+            if emb is None:
+                self.misses += 1
+                metrics.EMBEDDING_CACHE_MISSES.inc()
+                return None
+            self._data.move_to_end(text)
+            self.hits += 1
+            metrics.EMBEDDING_CACHE_HITS.inc()
+            return emb
+
+    def put(self, text, emb):
+        emb = np.array(emb, dtype=np.float32)
+        emb.setflags(write=False)
+        if emb.nbytes > self.max_bytes or self.max_items <= 0:
+            return
+        with self._lock:
+            old = self._data.pop(text, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._data[text] = emb
+            self.nbytes += emb.nbytes
+            # Evict least recently used entries until both bounds hold
+            while len(self._data) > self.max_items or self.nbytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
 
 class SentenceBert:
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, model_name=config.model_name, cache=None, backend=config.encoder_model["backend"]):
+        # Backends load torch or onnxruntime only when selected (see app/encoders.py)
+        self.model = createEncoder(backend, model_name)
+        self.cache = EmbeddingCache() if cache is None else cache
 
-    #@functools.lru_cache(1000)
     def __call__(self, list_text, to_tensor=False):
-        arr_text_embedded = self.model.encode(list_text, convert_to_tensor=to_tensor)
+        """
+            Embed a list of (normalized) texts
+            Cached texts are served from the cache; only texts not seen before are encoded,
+            each of them once per call.
+        """
+        if to_tensor or isinstance(list_text, str) or len(list_text) == 0:
+            return self.model.encode(list_text, convert_to_tensor=to_tensor)
+
+        list_emb = [self.cache.get(text) for text in list_text]
+        # Unique texts that missed the cache, in order of first appearance
+        list_missing = list(dict.fromkeys(text for text, emb in zip(list_text, list_emb) if emb is None))
+        if list_missing:
+            arr_new = self.model.encode(list_missing)
+            dict_new = dict(zip(list_missing, arr_new))
+            for text, emb in dict_new.items():
+                self.cache.put(text, emb)
+            list_emb = [dict_new[text] if emb is None else emb for text, emb in zip(list_text, list_emb)]
+        arr_text_embedded = np.stack(list_emb).astype(np.float32, copy=False)
         return arr_text_embedded
 
-def calculate_similarity_index(target, pool):
-    similarities = cosine_similarity(target, pool).squeeze()
-    idx_sorted = np.argsort(similarities, kind="quicksort")[::-1]
+    def encode_batch(self, list_text, batch_size=config.import_encode_batch):
+        """
+            Embed many texts in large forward passes, bypassing the cache (e.g. for a bulk import,
+            whose questions would only evict the cached asks)
+        """
+        if len(list_text) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.model.encode(list_text, batch_size=batch_size)
+
+# Process-wide encoders, one per model name
+_models = {}
+_models_lock = threading.Lock()
+
+def get_model(model_name=config.model_name):
+    """
+        Return the shared encoder of this process, loading it from disk on first use only
+        Inputs:
+            model_name (str): Name of the SentenceTransformer model
+        Returns:
+            model (SentenceBert): The same instance on every call with the same model_name
+    """
+    model = _models.get(model_name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = SentenceBert(model_name)
+                _models[model_name] = model
+    return model
+
+def warmup_model(model_name=config.model_name):
+    """
+        Load the shared encoder and run one encode so the first real request does not pay
+        for lazy initialization
+    """
+    model = get_model(model_name)
+    model(["warm up"])
+    return model
+
+class EncoderScheduler:
+    """
+        Micro-batching front end of an encoder for async callers.
+        Texts submitted concurrently are gathered for a short window (or until the batch is full),
+        encoded together in a worker thread, and each caller's future is resolved with its row.
+        The event loop never runs a forward pass itself.
+    """
+    def __init__(self, model, max_batch=config.encoder_max_batch, window_ms=config.encoder_batch_window_ms):
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._queue = None
+        self._task = None
+        # A single thread: batches are encoded one after another, the model parallelizes internally
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+
+    def start(self):
+        """
+            Start the batching loop on the running event loop
+        """
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def encode(self, list_text):
+        """
+            Embed a list of texts through the shared micro-batches
+            Inputs:
+                list_text (list): Normalized texts
+            Returns:
+                arr_text_embedded (ndarray): Embeddings of shape (len(list_text), dim)
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        list_future = []
+        for text in list_text:
+            future = loop.create_future()
+            self._queue.put_nowait((text, future))
+            list_future.append(future)
+        return np.stack(await asyncio.gather(*list_future))
+
+    async def encode_list(self, list_text):
+        """
+            Embed a whole list of texts in one call of the model, in the encoder thread
+            (for batch requests, which gain nothing from being split into micro-batches)
+            Inputs:
+                list_text (list): Normalized texts
+            Returns:
+                arr_text_embedded (ndarray): Embeddings of shape (len(list_text), dim)
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, profiling.call, self.model, list_text)
+
+    async def _collect(self):
+        """
+            Wait for the first pending text, then keep collecting until the window closes or the batch is full
+        """
+        loop = asyncio.get_running_loop()
+        list_item = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(list_item) < self.max_batch:
+            if not self._queue.empty():
+                list_item.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                list_item.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return list_item
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            list_item = await self._collect()
+            list_text = [text for text, _ in list_item]
+            metrics.ENCODER_BATCH_SIZE.observe(len(list_text))
+            try:
+                arr_emb = await loop.run_in_executor(self._executor, profiling.call, self.model, list_text)
+            except Exception as e:
+                for _, future in list_item:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), emb in zip(list_item, arr_emb):
+                # The caller may have gone away (e.g. client disconnected)
+                if not future.done():
+                    future.set_result(emb)
+
+def normalize_rows(arr):
+    """
+        L2-normalize every row of a 2-D array
+        Inputs:
+            arr (ndarray): Array of shape (n, dim)
+        Returns:
+            arr_normalized (ndarray): C-contiguous float32 array of shape (n, dim) whose rows have unit norm
+    """
+    arr = np.array(arr, dtype=np.float32, order="C", ndmin=2)
+    norms = np.linalg.norm(arr, axis=1, keepdims=True)
+    # Leave all-zero rows untouched instead of dividing by zero
+    norms[norms == 0] = 1
+    arr /= norms
+    return arr
+
+def top_k_indices(similarities, k):
+    """
+        Indices of the k largest similarities, most similar first
+        Only the k winners are sorted; the rest of the pool is split off with argpartition.
+    """
+    n = similarities.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        idx = np.argpartition(similarities, n - k)[n - k:]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-similarities[idx], kind="stable")]
+
+def top_k_indices_rows(similarities, k):
+    """
+        Row-wise top_k_indices of a 2-D array of similarities (one row per query)
+        Returns:
+            idx_topk (ndarray): Array of shape (m, min(k, n)), most similar first in every row
+    """
+    m, n = similarities.shape
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((m, 0), dtype=np.intp)
+    if k < n:
+        idx = np.argpartition(similarities, n - k, axis=1)[:, n - k:]
+    else:
+        idx = np.tile(np.arange(n), (m, 1))
+    order = np.argsort(-np.take_along_axis(similarities, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+def qid_segments(qids):
+    """
+        Group rows by qid for segment reductions
+        Inputs:
+            qids (ndarray): qid of every row
+        Returns:
+            order (ndarray): Row indices sorted by qid (rows of one qid keep their order),
+                             or None if the rows of every qid are already contiguous (the usual case,
+                             as the questions of a QA pair are loaded and added together)
+            starts (ndarray): Position in order where the rows of each distinct qid start
+    """
+    if len(qids) == 0:
+        return None, np.empty(0, dtype=np.intp)
+    runs = np.flatnonzero(np.r_[True, qids[1:] != qids[:-1]])
+    if runs.shape[0] == np.unique(qids).shape[0]:
+        return None, runs
+    order = np.argsort(qids, kind="stable")
+    sorted_qids = qids[order]
+    return order, np.flatnonzero(np.r_[True, sorted_qids[1:] != sorted_qids[:-1]])
+
+def top_k_by_qid(similarities, qids, k, segments=None):
+    """
+        Keep the k qids with the highest similarity, the similarity of a qid being the highest of its rows
+        (max-pooling), each represented by its most similar row.
+        The qids of the top rows are taken in order of similarity: the first k distinct ones are the top k qids.
+        Only when those rows belong to fewer than k qids is every qid pooled, with np.maximum.reduceat
+        over the rows grouped by qid.
+        Inputs:
+            similarities (ndarray): Similarities of shape (n,), or (m, n) for m queries
+            qids (ndarray): qid of every row
+            k (int): Number of distinct qids
+            segments (tuple): Row grouping (order, starts) as returned by qid_segments(qids), computed if needed
+        Returns:
+            idx_topk (ndarray): Best row of each of the top qids, most similar first (shape (m, k') for m queries)
+            arr_similarities (ndarray): Similarities of those rows, which are the pooled similarities of their qids
+    """
+    single = similarities.ndim == 1
+    arr_sim = np.atleast_2d(similarities)
+    m, n = arr_sim.shape
+    n_shortlist = min(n, k * _QID_SHORTLIST_FACTOR)
+    arr_shortlist = top_k_indices(similarities, n_shortlist)[None, :] if single else top_k_indices_rows(arr_sim, n_shortlist)
+    list_idx = []
+    for i in range(m):
+        # First row of each qid, in order of similarity
+        dict_first = {}
+        for row, qid in zip(arr_shortlist[i].tolist(), qids[arr_shortlist[i]].tolist()):
+            dict_first.setdefault(qid, row)
+        if len(dict_first) >= k or n_shortlist == n:
+            list_idx.append(np.array(list(dict_first.values())[:k], dtype=np.intp))
+            continue
+        # A few qids with many similar rows fill the shortlist: pool every qid
+        if segments is None:
+            segments = qid_segments(qids)
+        order, starts = segments
+        # Rows already grouped by qid are reduced in place, without a gather
+        sorted_sim = arr_sim[i] if order is None else arr_sim[i, order]
+        pooled = np.maximum.reduceat(sorted_sim, starts)
+        ends = np.r_[starts[1:], n]
+        list_row = []
+        for segment in top_k_indices(pooled, k).tolist():
+            row = starts[segment] + np.argmax(sorted_sim[starts[segment]:ends[segment]])
+            list_row.append(row if order is None else order[row])
+        list_idx.append(np.array(list_row, dtype=np.intp))
+    idx_topk = np.array(list_idx, dtype=np.intp).reshape(m, -1)
+    arr_topk_sim = np.take_along_axis(arr_sim, idx_topk, axis=1)
+    return (idx_topk[0], arr_topk_sim[0]) if single else (idx_topk, arr_topk_sim)
+
+# Storage precisions of QuestionIndex rows
+PRECISIONS = ("float32", "float16", "int8")
+# Rows are converted to float32 this many at a time when scoring reduced-precision rows (fits in L2 cache)
+_SCORE_CHUNK_ROWS = 256
+# float16 rows are widened to float32 by moving their bits (numpy's float16 casts are not vectorized):
+# sign to bit 31, exponent and mantissa shifted by 13 bits. The exponent bias (15 instead of 127)
+# leaves every value 2**-112 times too small, which the queries make up for.
+_FLOAT16_MASK = np.int32(-0x70000001)  # 0x8FFFFFFF: sign bit and the shifted exponent/mantissa
+_FLOAT16_REBIAS = np.float32(2.0 ** 112)
+# Queries scored together by QuestionIndex.search_batch (bounds the (queries, rows) similarity matrix)
+_SEARCH_CHUNK_QUERIES = 64
+# top_k_by_qid first looks for k distinct qids among the k * _QID_SHORTLIST_FACTOR most similar rows
+_QID_SHORTLIST_FACTOR = 4
+
+# Rows moved at a time when compacting the rows of QuestionIndex (bounds the temporary copy of overlapping moves)
+_MOVE_CHUNK_ROWS = 4096
+
+def compact_rows(list_arr, drop, size):
+    """
+        Drop rows in place, keeping the order of the others: only the rows after the first dropped one
+        are moved, a run of kept rows at a time, in chunks of _MOVE_CHUNK_ROWS rows
+        Inputs:
+            list_arr (list): Arrays whose first size rows are aligned (matrix, qids, scales...)
+            drop (ndarray): Boolean mask over the first size rows, True for rows to drop
+            size (int): Number of rows in use
+        Returns:
+            n_keep (int): Number of rows kept, now the first n_keep rows of every array
+    """
+    first = int(np.argmax(drop)) if size else 0
+    if size == 0 or not drop[first]:
+        return size
+    tail = drop[first:size]
+    # Runs of dropped and kept rows from the first dropped row on
+    bounds = np.r_[0, np.flatnonzero(tail[1:] != tail[:-1]) + 1, tail.shape[0]] + first
+    n_keep = first
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if drop[start]:
+            continue
+        for chunk in range(start, end, _MOVE_CHUNK_ROWS):
+            m = min(_MOVE_CHUNK_ROWS, end - chunk)
+            for arr in list_arr:
+                arr[n_keep:n_keep + m] = arr[chunk:chunk + m]
+            n_keep += m
+    return n_keep
+
+def quantize_int8(rows):
+    """
+        Symmetric per-row int8 quantization: rows ~= q * scales[:, None]
+        Returns:
+            q (ndarray): int8 array of the same shape as rows
+            scales (ndarray): float32 scale of every row
+    """
+    rows = np.asarray(rows, dtype=np.float32).reshape(-1, np.shape(rows)[-1])
+    scales = np.abs(rows).max(axis=1) / 127
+    scales[scales == 0] = 1
+    q = np.round(rows / scales[:, None]).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+class QuestionIndex:
+    """
+        In-memory index over the embedded question bank.
+        Embeddings are L2-normalized once when the index is built, so scoring a query
+        is a single matrix-vector product instead of a full cosine_similarity call.
+        Every row remembers the qid of its QA pair, so the rows of one QA pair can be
+        added, replaced or removed without rebuilding the index.
+        Rows are stored as float32, float16, or int8 with one float32 scale per row.
+    """
+    def __init__(self, embeddings, qids=None, dim=None, precision=config.index_precision):
+        """
+            Inputs:
+                embeddings (array-like): Question embeddings of shape (n, dim)
+                qids (array-like): QA id of every row, shape (n,)
+                dim (int): Embedding dimension, only needed when embeddings is empty
+                precision (str): One of PRECISIONS
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision}")
+        self.precision = precision
+        if len(embeddings) == 0:
+            rows = np.empty((0, dim or 0), dtype=np.float32)
+        else:
+            rows = normalize_rows(embeddings)
+        self._buffer, self._scales = self._encode(rows)
+        self._size = self._buffer.shape[0]
+        self._qids = np.zeros(self._size, dtype=np.int64) if qids is None else np.array(qids, dtype=np.int64)
+        # Optional approximate search (ivf_index.IVFIndex) and its number of probed clusters
+        self.ivf = None
+        self.n_probe = None
+        # Rows grouped by qid (qid_segments), computed on the first search by qid after a change
+        self._segments = None
+
+    @classmethod
+    def from_normalized(cls, matrix, qids, precision=config.index_precision):
+        """
+            Wrap float32 rows that are already L2-normalized (e.g. a read-only memmap) without copying them
+            The rows are copied only when the index is modified for the first time, or right away
+            if they have to be converted to a lower precision.
+        """
+        index = cls([], dim=matrix.shape[1], precision=precision)
+        if precision == "float32":
+            index._buffer, index._scales = matrix, None
+        else:
+            index._buffer, index._scales = index._encode(matrix)
+        index._qids = qids
+        index._size = matrix.shape[0]
+        return index
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """
+            Memory held by the rows (and scales) of the index
+        """
+        nbytes = self.matrix.nbytes
+        if self._scales is not None:
+            nbytes += self._size * self._scales.itemsize
+        return nbytes
+
+    def _encode(self, rows):
+        """
+            Convert normalized float32 rows to the storage precision; returns (rows, scales or None)
+        """
+        if self.precision == "int8":
+            return quantize_int8(rows)
+        return rows.astype(self.precision, copy=False), None
+
+    def _ensure_writable(self):
+        """
+            Copy shared read-only rows into private memory before the first modification
+        """
+        if not self._buffer.flags.writeable:
+            self._buffer = np.array(self._buffer)
+        if not self._qids.flags.writeable:
+            self._qids = np.array(self._qids)
+
+    @property
+    def matrix(self):
+        return self._buffer[:self._size]
+
+    @property
+    def qids(self):
+        return self._qids[:self._size]
+
+    def dequantize(self):
+        """
+            The rows as float32 (the stored rows themselves for float32 precision)
+        """
+        if self.precision == "int8":
+            return self.matrix.astype(np.float32) * self._scales[:self._size, None]
+        return self.matrix.astype(np.float32, copy=False)
+
+    def add(self, qid, embeddings):
+        """
+            Append the questions of one QA pair
+            Capacity grows geometrically, so appends are amortized O(rows added).
+            Inputs:
+                qid (int): QA id shared by the new rows
+                embeddings (array-like): Question embeddings of shape (m, dim)
+        """
+        if len(embeddings) == 0:
+            return
+        self._ensure_writable()
+        rows = normalize_rows(embeddings)
+        stored, scales = self._encode(rows)
+        m = rows.shape[0]
+        if self._buffer.shape[1] == 0:
+            self._buffer = np.empty((0, rows.shape[1]), dtype=stored.dtype)
+        if self._size + m > self._buffer.shape[0]:
+            capacity = max(self._size + m, 2 * self._buffer.shape[0], 16)
+            buffer = np.empty((capacity, rows.shape[1]), dtype=self._buffer.dtype)
+            buffer[:self._size] = self.matrix
+            qids = np.empty(capacity, dtype=np.int64)
+            qids[:self._size] = self.qids
+            if self._scales is not None:
+                arr_scales = np.empty(capacity, dtype=np.float32)
+                arr_scales[:self._size] = self._scales[:self._size]
+                self._scales = arr_scales
+            self._buffer, self._qids = buffer, qids
+        self._buffer[self._size:self._size + m] = stored
+        self._qids[self._size:self._size + m] = qid
+        if self._scales is not None:
+            self._scales[self._size:self._size + m] = scales
+        self._size += m
+        self._segments = None
+        if self.ivf is not None:
+            self.ivf.add(rows)
+
+    def remove(self, qid):
+        """
+            Remove every question of one QA pair; the remaining rows keep their order
+            Returns:
+                keep (ndarray): Boolean mask over the old rows, True for rows that were kept
+        """
+        return self.remove_qids([qid])
+
+    def remove_qids(self, list_qid):
+        """
+            Remove every question of several QA pairs at once; the remaining rows keep their order
+            Only the rows after the first removed one are moved (compact_rows), so removing
+            recently added QA pairs is cheap however large the index is.
+            Returns:
+                keep (ndarray): Boolean mask over the old rows, True for rows that were kept
+        """
+        drop = self.qids == list_qid[0] if len(list_qid) == 1 else np.isin(self.qids, list_qid)
+        if drop.any():
+            self._ensure_writable()
+            list_arr = [self._buffer, self._qids] + ([self._scales] if self._scales is not None else [])
+            self._size = compact_rows(list_arr, drop, self._size)
+            self._segments = None
+            if self.ivf is not None:
+                self.ivf.remove(~drop)
+        return ~drop
+
+    def replace(self, qid, embeddings):
+        """
+            Swap the questions of one QA pair for new ones (remove, then append)
+            Returns:
+                keep (ndarray): Boolean mask over the old rows, as returned by remove()
+        """
+        keep = self.remove(qid)
+        self.add(qid, embeddings)
+        return keep
+
+    def score(self, query, rows=None):
+        """
+            Similarities between normalized float32 queries and the stored rows
+            Inputs:
+                query (ndarray): L2-normalized query of shape (dim,), or m queries of shape (m, dim)
+                rows (ndarray): Row indices to score; all rows if None
+            Returns:
+                similarities (ndarray): float32 array, one entry per scored row
+                                        (of shape (rows, m) for m queries)
+        """
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if self.precision == "float32":
+            return matrix @ query.T
+        queries = query.reshape(-1, query.shape[-1])
+        if self.precision == "int8":
+            # Integer dot products of int8 rows and int8 queries. Every partial sum stays below 2**24,
+            # so float32 BLAS computes them exactly and much faster than numpy integer matmul.
+            q_queries, q_scales = quantize_int8(queries)
+            queries = q_queries.astype(np.float32)
+            chunk = np.empty((min(_SCORE_CHUNK_ROWS, matrix.shape[0]), matrix.shape[1]), dtype=np.float32)
+        else:
+            # float16: the sign-extended bits are shifted in an int32 chunk read as float32 (_FLOAT16_MASK)
+            matrix = matrix.view(np.int16)
+            queries = queries * _FLOAT16_REBIAS
+            chunk = np.empty((min(_SCORE_CHUNK_ROWS, matrix.shape[0]), matrix.shape[1]), dtype=np.int32)
+        similarities = np.empty((matrix.shape[0], queries.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], _SCORE_CHUNK_ROWS):
+            stop = min(start + _SCORE_CHUNK_ROWS, matrix.shape[0])
+            rows_chunk = chunk[:stop - start]
+            rows_chunk[:] = matrix[start:stop]
+            if self.precision == "float16":
+                np.left_shift(rows_chunk, 13, out=rows_chunk)
+                np.bitwise_and(rows_chunk, _FLOAT16_MASK, out=rows_chunk)
+                rows_chunk = rows_chunk.view(np.float32)
+            similarities[start:stop] = rows_chunk @ queries.T
+        if self.precision == "int8":
+            scales = self._scales[:self._size] if rows is None else self._scales[rows]
+            similarities *= scales[:, None] * q_scales[None, :]
+        return similarities[:, 0] if query.ndim == 1 else similarities
+
+    def segments(self):
+        """
+            Rows grouped by qid, as returned by qid_segments (cached until the rows change)
+        """
+        if self._segments is None:
+            self._segments = qid_segments(self.qids)
+        return self._segments
+
+    def search(self, target, k, by_qid=False):
+        """
+            Find the k questions most similar to a target embedding
+            Inputs:
+                target (array-like): Embedding of shape (dim,) or (1, dim)
+                k (int): Number of questions to return
+                by_qid (bool): Return the best question of each of the k most similar QA pairs instead,
+                               the similarity of a QA pair being the highest of its questions
+            Returns:
+                idx_topk (ndarray): Row indices of the top k questions, most similar first
+                arr_similarities (ndarray): Cosine similarities of those rows
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        query = normalize_rows(np.reshape(target, (1, -1)))[0]
+        if self.ivf is not None and self.n_probe:
+            # Approximate: only the rows of the closest clusters are scored
+            candidates = self.ivf.shortlist(query, self.n_probe)
+            if by_qid:
+                idx, similarities = top_k_by_qid(self.score(query, candidates), self.qids[candidates], k)
+                if idx.shape[0] >= k:
+                    return candidates[idx], similarities
+            elif candidates.shape[0] >= k:
+                similarities = self.score(query, candidates)
+                idx = top_k_indices(similarities, k)
+                return candidates[idx], similarities[idx]
+        similarities = self.score(query)
+        if by_qid:
+            return top_k_by_qid(similarities, self.qids, k, self.segments())
+        idx_topk = top_k_indices(similarities, k)
+        return idx_topk, similarities[idx_topk]
+
+    def search_batch(self, targets, k, by_qid=False):
+        """
+            Find the k questions most similar to each of several target embeddings, scoring a chunk
+            of queries against all rows with one matrix-matrix product (always exact, even with IVF)
+            Inputs:
+                targets (array-like): Embeddings of shape (m, dim)
+                k (int): Number of questions to return per target
+                by_qid (bool): Return the best question of each of the k most similar QA pairs, as search() does
+            Returns:
+                idx_topk (ndarray): Row indices of shape (m, k'), most similar first in every row
+                arr_similarities (ndarray): Cosine similarities of those rows, same shape
+        """
+        queries = normalize_rows(targets)
+        m = queries.shape[0]
+        if len(self) == 0:
+            return np.empty((m, 0), dtype=np.intp), np.empty((m, 0), dtype=np.float32)
+        list_idx, list_similarities = [], []
+        for start in range(0, m, _SEARCH_CHUNK_QUERIES):
+            similarities = np.ascontiguousarray(self.score(queries[start:start + _SEARCH_CHUNK_QUERIES]).T)
+            if by_qid:
+                idx_topk, arr_similarities = top_k_by_qid(similarities, self.qids, k, self.segments())
+            else:
+                idx_topk = top_k_indices_rows(similarities, k)
+                arr_similarities = np.take_along_axis(similarities, idx_topk, axis=1)
+            list_idx.append(idx_topk)
+            list_similarities.append(arr_similarities)
+        return np.concatenate(list_idx), np.concatenate(list_similarities)
+
+def calculate_similarity_index(target, pool, k=None, qids=None):
+    """
+        Cosine similarities between a target embedding and a pool of embeddings
+        Inputs:
+            target (array-like): Embedding of shape (dim,) or (1, dim)
+            pool (array-like): Embeddings of shape (n, dim)
+            k (int): If given, only the top k indices are returned
+            qids (array-like): If given, the qid of every row of the pool; only the most similar row
+                               of each qid is returned
+        Returns:
+            idx_sorted (ndarray): Pool indices sorted by similarity, most similar first
+            similarities (ndarray): Similarities for every row of the pool
+    """
+    query = normalize_rows(np.reshape(target, (1, -1)))[0]
+    similarities = normalize_rows(pool) @ query
+    if qids is not None:
+        qids = np.asarray(qids)
+        idx_sorted, _ = top_k_by_qid(similarities, qids, np.unique(qids).shape[0] if k is None else k)
+    elif k is None:
+        idx_sorted = np.argsort(-similarities, kind="stable")
+    else:
+        idx_sorted = top_k_indices(similarities, k)
     return idx_sorted, similarities
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+# Sampled profiling of HTTP requests, to find where the time of slow requests goes
+# (tokenization, the forward pass, the similarity scan, MySQL...).
+# Off by default. When on, a fraction config.profiling["sample_rate"] of the requests under
+# config.profiling["paths"] run under cProfile. Before Python 3.12 cProfile only sees the thread that
+# enabled it, so what they hand to the encoder and database threads is profiled in those threads (see call)
+# and merged in; from 3.12 on (sys.monitoring) the profiler of the request already sees every thread and
+# allows no other one. Either way every sampled request leaves one pstats file in
+# config.profiling["dir"], which keeps the newest config.profiling["max_files"] profiles
+# (open them with snakeviz or pstats, or GET /manage/profiling/{name}?format=text).
+# A profile covers everything the event loop of the worker ran while the request was in flight,
+# concurrent requests included; a worker profiles one request at a time.
+# PUT /manage/profiling saves the switch and the rate in the profile directory, where every worker of the
+# host picks them up within config.profiling["refresh"] seconds.
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from . import config
+
+SETTINGS_FILE = "settings.json"
+# <time_ns>-<pid>-<method>-<path, "/" written "~">-<duration>ms.prof
+_PROFILE_NAME = re.compile(r"^(\d+)-(\d+)-([A-Z]+)-([\w.~-]*)-(\d+)ms\.prof$")
+SORT_KEYS = tuple(pstats.Stats.sort_arg_dict_default)
+# cProfile hooks only the thread that enables it (before sys.monitoring)
+PER_THREAD = sys.version_info < (3, 12)
+
+_settings = {"enabled": config.profiling["enabled"], "sample_rate": config.profiling["sample_rate"]}
+_settings_mtime = None
+_next_refresh = 0.0
+# The request this worker is profiling, if any
+_session = None
+
+class _Session:
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.profiler = cProfile.Profile()
+        self.list_thread_profiler = []
+
+def _settingsPath():
+    return os.path.join(config.profiling["dir"], SETTINGS_FILE)
+
+def _writeAtomic(directory, name, write):
+    # Readers never see a partial file: write to a temporary file, then rename it
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}-")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except:
+        os.remove(tmp_path)
+        raise
+
+def refreshSettings():
+    """
+        Pick up the settings saved by saveSettings (in any worker), at most every config.profiling["refresh"] seconds
+        Returns:
+            enabled (bool)
+    """
+    global _settings_mtime, _next_refresh
+    now = time.monotonic()
+    if now >= _next_refresh:
+        _next_refresh = now + config.profiling["refresh"]
+        try:
+            mtime = os.stat(_settingsPath()).st_mtime_ns
+            if mtime != _settings_mtime:
+                with open(_settingsPath()) as f:
+                    settings = json.load(f)
+                _settings.update(enabled=bool(settings["enabled"]), sample_rate=float(settings["sample_rate"]))
+                _settings_mtime = mtime
+        except (OSError, ValueError, KeyError, TypeError):
+            # No saved settings (config.profiling applies) or an unreadable file (the last ones apply)
+            pass
+    return _settings["enabled"]
+
+def getSettings():
+    refreshSettings()
+    return dict(_settings)
+
+def saveSettings(enabled, sample_rate):
+    """
+        Switch profiling on or off for every worker of this host
+        Inputs:
+            enabled (bool)
+            sample_rate (float): Fraction of the matching requests to profile, between 0 and 1
+        Returns:
+            settings (dict)
+    """
+    global _next_refresh
+    settings = {"enabled": enabled, "sample_rate": sample_rate}
+
+    def write(path):
+        with open(path, "w") as f:
+            json.dump(settings, f)
+    _writeAtomic(config.profiling["dir"], SETTINGS_FILE, write)
+    _next_refresh = 0.0
+    return getSettings()
+
+def call(func, *args, **kwargs):
+    """
+        Run func in a worker thread (encoder, database), profiled into the request being profiled if there is one
+    """
+    session = _session
+    if not PER_THREAD or session is None or session.thread_id == threading.get_ident():
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        session.list_thread_profiler.append(profiler)
+
+def saveProfile(session, method, path, duration):
+    """
+        Merge the profiles of a request into one pstats file and drop the oldest files beyond config.profiling["max_files"]
+        Returns:
+            name (str): File name of the profile
+    """
+    stats = pstats.Stats(session.profiler)
+    for profiler in session.list_thread_profiler:
+        stats.add(profiler)
+    slug = "~".join(re.sub(r"[^\w.-]+", "_", part) for part in path.strip("/").split("/"))[:80]
+    name = f"{time.time_ns()}-{os.getpid()}-{method}-{slug}-{round(duration * 1000)}ms.prof"
+    directory = config.profiling["dir"]
+    _writeAtomic(directory, name, stats.dump_stats)
+
+    list_name = sorted((n for n in os.listdir(directory) if _PROFILE_NAME.match(n)),
+                       key=lambda n: int(n.split("-", 1)[0]))
+    for old in list_name[:-config.profiling["max_files"]]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            # Already removed by another worker
+            pass
+    return name
+
+def listProfiles():
+    """
+        Profiles kept on this host, newest first
+        Returns:
+            list_profile (list): {"name", "created", "pid", "method", "path", "duration_ms", "size"} of every profile
+    """
+    directory = config.profiling["dir"]
+    try:
+        list_name = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    list_profile = []
+    for name in list_name:
+        match = _PROFILE_NAME.match(name)
+        if match is None:
+            continue
+        try:
+            size = os.path.getsize(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        time_ns, pid, method, path, duration_ms = match.groups()
+        list_profile.append({"name": name,
+                             "created": datetime.fromtimestamp(int(time_ns) / 1e9, timezone.utc).isoformat(timespec="milliseconds"),
+                             "pid": int(pid), "method": method, "path": "/" + path.replace("~", "/"), "duration_ms": int(duration_ms),
+                             "size": size})
+    list_profile.sort(key=lambda profile: int(profile["name"].split("-", 1)[0]), reverse=True)
+    return list_profile
+
+def profilePath(name):
+    """
+        Path of a profile kept on this host, or None if there is no such profile
+    """
+    if _PROFILE_NAME.match(name) is None:
+        return None
+    path = os.path.join(config.profiling["dir"], name)
+    return path if os.path.isfile(path) else None
+
+def renderProfile(path, sort="cumulative", limit=50):
+    """
+        A profile as the text of pstats, its limit heaviest functions by sort
+    """
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+class ProfilingMiddleware:
+    """
+        ASGI middleware profiling a sample of the requests under config.profiling["paths"] while profiling is on.
+        While it is off, a request only costs a check of the settings.
+    """
+    def __init__(self, app, logger):
+        self.app = app
+        self.logger = logger
+
+    async def __call__(self, scope, receive, send):
+        global _session
+        if scope["type"] != "http" or not refreshSettings():
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if (_session is not None or not path.startswith(config.profiling["paths"])
+                or path.startswith("/manage/profiling") or random.random() >= _settings["sample_rate"]):
+            return await self.app(scope, receive, send)
+
+        session = _Session()
+        try:
+            session.profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger or coverage on Python 3.12+) is active: serve the request unprofiled
+            return await self.app(scope, receive, send)
+        _session = session
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.profiler.disable()
+            duration = time.perf_counter() - start
+            _session = None
+            # The response has been sent; write the file off the event loop
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, saveProfile, session, scope["method"], path, duration)
+            except Exception:
+                self.logger.exception(f"An error occurred while saving the profile of {scope['method']} {path}")
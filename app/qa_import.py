@@ -0,0 +1,111 @@
+# Bulk import of QA pairs from an xlsx, CSV or JSONL file.
+# Rows are streamed from the file, and every chunk of config.import_chunk_size QA pairs is
+# inserted in one transaction together with an embedding job per QA pair. Nothing is encoded here:
+# the embedding runners (app/embedding_jobs.py) encode the questions, so an import never takes CPU
+# from /chatbot/ask, and the QA pairs become answerable as their jobs complete.
+#
+# xlsx / CSV: a header row with "question" and "answer" columns; a question cell may hold several
+#             similar questions, one per line
+# JSONL: one {"question": [...] or "...", "answer": "..."} object per line
+import csv
+import io
+import json
+from itertools import islice
+from . import config
+from .database.mysql_funcs import createQuestionAnswerBatch
+from .model_func import normalize_text
+
+FORMATS = ("xlsx", "csv", "jsonl")
+
+def splitQuestions(cell):
+    """
+        Questions of one xlsx/CSV cell (one per line) or of one JSONL field (a string or a list)
+    """
+    if cell is None:
+        return []
+    list_q = cell if isinstance(cell, list) else str(cell).splitlines()
+    return [str(q).strip() for q in list_q if str(q).strip()]
+
+def _readTable(rows):
+    # rows: iterable of sequences whose first item is the header
+    rows = iter(rows)
+    header = [str(name).strip().lower() if name is not None else "" for name in next(rows, [])]
+    if "question" not in header or "answer" not in header:
+        raise ValueError('The header row must contain "question" and "answer" columns')
+    i_question, i_answer = header.index("question"), header.index("answer")
+    for row in rows:
+        question = row[i_question] if i_question < len(row) else None
+        answer = row[i_answer] if i_answer < len(row) else None
+        yield splitQuestions(question), str(answer).strip() if answer is not None else ""
+
+def readRows(file, fmt):
+    """
+        Stream the QA pairs of a file
+        Inputs:
+            file: A binary file object
+            fmt (str): "xlsx", "csv" or "jsonl"
+        Returns:
+            A generator of (questions, answer) tuples
+    """
+    if fmt == "xlsx":
+        from openpyxl import load_workbook
+        # read_only mode parses rows lazily instead of loading the whole sheet
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            yield from _readTable(workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    elif fmt == "csv":
+        yield from _readTable(csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline="")))
+    elif fmt == "jsonl":
+        for line in io.TextIOWrapper(file, encoding="utf-8"):
+            if line.strip():
+                item = json.loads(line)
+                yield splitQuestions(item.get("question")), str(item.get("answer") or "").strip()
+    else:
+        raise ValueError(f"Unsupported format {fmt}, expected one of {FORMATS}")
+
+def importQA(file, fmt, logger, chunk_size=config.import_chunk_size):
+    """
+        Import all QA pairs of a file into MySQL (blocking; run it with runDB from async code)
+        Every chunk is inserted with its embedding jobs in its own transaction; the caller wakes the runner.
+        Inputs:
+            file: A binary file object
+            fmt (str): "xlsx", "csv" or "jsonl"
+            logger (Logger): A logging object for logging errors
+            chunk_size (int): QA pairs per transaction
+        Returns:
+            result (dict): Numbers of imported QA pairs and questions, skipped rows, and an error message
+                           (None on success); chunks committed before an error stay imported
+    """
+    result = {"qa": 0, "questions": 0, "skipped": 0, "error": None}
+    rows = readRows(file, fmt)
+    try:
+        while True:
+            list_row = list(islice(rows, chunk_size))
+            if not list_row:
+                break
+            list_qa = []
+            for list_q, answer in list_row:
+                # Preproceed questions; rows without a question or an answer are skipped
+                list_q = [normalize_text(q) for q in list_q]
+                if not list_q or not answer:
+                    result["skipped"] += 1
+                    continue
+                list_qa.append((list_q, answer))
+            if not list_qa:
+                continue
+            if createQuestionAnswerBatch(list_qa, logger) is None:
+                result["error"] = "An error occurred while inserting a batch of rows into QA tables"
+                break
+            result["qa"] += len(list_qa)
+            result["questions"] += sum(len(list_q) for list_q, _ in list_qa)
+            logger.info(f"Imported {result['qa']} QA pairs ({result['questions']} questions)")
+    except (ValueError, KeyError, UnicodeDecodeError, csv.Error) as e:
+        logger.exception("An error occurred while reading the import file")
+        result["error"] = f"An error occurred while reading the import file: {e}"
+    except Exception as e:
+        # Still return what was committed, so that the caller wakes the runner for it
+        logger.exception("An error occurred while importing QA pairs")
+        result["error"] = f"An error occurred while importing QA pairs: {e!r}"
+    return result
@@ -1,34 +1,68 @@
-import os
-import requests
-import json
-import pickle
 from pydantic import BaseModel, Field  #HttpUrl
-from fastapi import APIRouter  #Body, Query, Path, Depends, HTTPException
-from typing import List  #Set, Dict, Optional
+from fastapi import APIRouter, File, UploadFile  #Body, Query, Path, Depends, HTTPException
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from typing import List, Optional  #Set, Dict
+from itertools import chain
+import json
+import os
+from .. import config
 from .. import logger
-from ..database.mysql_funcs import getQuestionAnswer, getAllQuestionAnswer, createQuestionAnswer, createQuestionEmbedding, createQuestionEmbedding, updateQuestionAnswer, deleteQuestionAnswer, deleteAllQuestionAnswer, deleteQuestionEmbedding
-from model_func import SentenceBert
+from .. import profiling
+from ..database.mysql_funcs import runDB, getQuestionAnswer, getQuestionAnswerPage, iterQuestionAnswer, countQuestionAnswer, createQuestionAnswer, updateQuestionAnswer, deleteQuestionAnswer, deleteAllQuestionAnswer, getEmbeddingJob, reembedQuestionAnswer
+from ..model_func import normalize_text
+from ..encoders import encoderId
+from ..qa_import import FORMATS, importQA
+from ..embedding_jobs import EmbeddingJobRunner
+from . import chatbotAPI
 
 router = APIRouter()
 logger_qaAdmin = logger.setForWritefile("QA_manage", "app/logs/QA_manage.log")
+job_runner = None
+
+def applyEmbeddings(list_applied):
+    """
+        Apply the embeddings stored by a batch of embedding jobs of this worker to the in-memory index
+        Inputs:
+            list_applied (list): (qid, questions, answer, embeddings, version) tuples, as returned by processJobs
+    """
+    # Their previous rows leave the index in a single compaction
+    chatbotAPI.removeQAs([qid for qid, _, _, _, _ in list_applied])
+    for qid, list_q, answer, arr_emb, version in list_applied:
+        chatbotAPI.upsertQA(qid, list_q, answer, arr_emb)
+        chatbotAPI.markVersion(version)
 
 @router.on_event("startup")
 async def startup_event():
+    global job_runner
+    # Some FastAPI versions run router startup handlers twice; keep a single runner
+    if config.embedding_jobs["runner"] == "app" and job_runner is None:
+        job_runner = EmbeddingJobRunner(logger_qaAdmin, on_applied=applyEmbeddings)
+        job_runner.start()
     await checkQA()
     
 @router.on_event("shutdown")
 async def shutdown_event():
-    pass
+    global job_runner
+    if job_runner is not None:
+        await job_runner.stop()
+        job_runner = None
+
+def wakeRunner():
+    """
+        Have this worker's runner process the newly enqueued embedding jobs right away
+    """
+    if job_runner is not None:
+        job_runner.wake()
 
 @router.get("/check")
 async def checkQA():
     """
         Check if there are QA data in our database. If not, insert some default data.
     """
-    data = getAllQuestionAnswer(logger_qaAdmin)
-    if data == False:
-        return {"msg": "An error occurred while fetching all data from QA table"}
-    elif len(data) == 0:
+    n = await runDB(countQuestionAnswer, logger_qaAdmin)
+    if n is None:
+        return {"msg": "An error occurred while counting rows of QA table"}
+    elif n == 0:
         list_toy_data = [
             QA_params(question=["Where is the gym?", "Wanna go exercise", "Is there a gym?", "Go for a treadmill workout"], answer="Please go to building A and the gym is at the basement 1"),
             QA_params(question=["Q2", "Q2-2", "Q2-3"], answer="Answer2"),
@@ -42,21 +76,48 @@ async def checkQA():
 
 
 @router.get("/QA")
-async def getTotalQA():  #conn: pymysql.Connection=Depends(mysql_conn)
+async def getTotalQA(after_id: int = 0, limit: int = config.qa_page_size):  #conn: pymysql.Connection=Depends(mysql_conn)
     """
-        Fetch all QA pairs
+        Fetch QA pairs one page at a time, ordered by id
+        Pass next_after_id of a page as after_id to fetch the next one; it is None on the last page.
+        limit is capped at config.qa_page_max. Use /QA/export to download the whole table.
     """
-    data = getAllQuestionAnswer(logger_qaAdmin)
+    limit = max(1, min(limit, config.qa_page_max))
+    data = await runDB(getQuestionAnswerPage, after_id, limit, logger_qaAdmin)
     if data == False:
-        return {"msg": "An error occurred while fetching all data from QA table"}
-    return data
+        return {"msg": "An error occurred while fetching a page of data from QA table"}
+    next_after_id = data[-1]["id"] if len(data) == limit else None
+    return {"data": data, "next_after_id": next_after_id}
+
+# Registered before /QA/{id}, which would otherwise match "export" as an id
+@router.get("/QA/export")
+async def exportQA():
+    """
+        Stream all QA pairs as NDJSON, one {"id", "question", "answer"} object per line
+        Questions are exported as a list, so the file can be imported again through /QA/import.
+    """
+    batches = iterQuestionAnswer(logger_qaAdmin)
+    # Fetch the first rows before the response starts, so a database error still gets an error message
+    try:
+        first = await runDB(next, batches, [])
+    except:
+        return {"msg": "An error occurred while streaming data from QA table"}
+
+    def lines():
+        # Runs in a thread pool, one batch of rows per chunk of the response
+        for list_data in chain([first], batches):
+            yield "".join(json.dumps({"id": row["id"], "question": json.loads(row["question"]), "answer": row["answer"]},
+                                     ensure_ascii=False) + "\n" for row in list_data)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": 'attachment; filename="QA.jsonl"'})
 
 @router.get("/QA/{id}")  #deprecated=True
 async def getQAbyId(id: int):  #conn: pymysql.Connection=Depends(mysql_conn)
     """
         Fetch a certain QA pair given id
     """
-    data = getQuestionAnswer(id, logger_qaAdmin)
+    data = await runDB(getQuestionAnswer, id, logger_qaAdmin)
     if data == False:
         return {"msg": "An error occurred while fetching a data from QA table"}
     return data
@@ -74,136 +135,157 @@ async def createQA(params: QA_params):  #conn: pymysql.Connection=Depends(mysql_
     if len(params.question) == 0:
         return {"msg": "Error: At least one question must be provided in a question list!"}
     
-    list_q = []  # Will append processed questions
     # Preproceed a list of questions
-    for q in params.question:
-        q = q.lower().strip()
-        # Remove some punctuations
-        for punc in ["?", "？", "!", "！"]:
-            if punc in q:
-                q = q.replace(punc, "")
-        # Replace some punctuations
-        for punc, punc_new in {",": "，", "(": "（", ")": "）"}.items():
-            if punc in q:
-                q = q.replace(punc, punc_new)
-
-        list_q.append(q)
+    list_q = [normalize_text(q) for q in params.question]
     
-    id = createQuestionAnswer(list_q, params.answer, logger_qaAdmin)
-    if id is None:
+    # The QA row and its embedding job are committed together
+    result = await runDB(createQuestionAnswer, list_q, params.answer, logger_qaAdmin)
+    if result is None:
         return {"msg": "An error occurred while inserting a row into QA table"}
+    id, job_id = result
 
+    # The questions are embedded in the background; they are answerable once the job is done
+    wakeRunner()
 
-    model = SentenceBert()
-    # Embed questions
-    arr_q_embedded = model(list_q)
-    
-    list_data = [{"qid": id, "question": q, "answer": params.answer, "question_embed": json.dumps(arr_q_embedded)} for q in list_q]
-
-    status = createQuestionEmbedding(list_data, logger_qaAdmin)
-    if not status:
-        return {"msg": "An error occurred while inserting data into QA embedding table"}
+    return {"msg": "success", "Question ID": id, "Job ID": job_id}
 
-    # Reload data
-    try:
-        response = requests.get(f"http://{os.getenv('LOCALHOST')}:80/chatbot/hr/ReLoad")
-        logger_qaAdmin.info(f"response: {response}, r.text: {response.text}")
-    except:
-        logger_qaAdmin.exception("Something goes wrong while sending a request to API 'ReLoad'")
-        return {"msg": "An error occurred while reloading data from tables"}
+@router.post("/QA/import")
+async def importQAFile(file: UploadFile = File(...), format: Optional[str] = None):
+    """
+        Bulk import QA pairs from an xlsx, CSV or JSONL file (layout described in app/qa_import.py)
+        Rows are inserted chunk by chunk with an embedding job per QA pair, which the runners encode.
+        The format is taken from the file extension unless given.
+    """
+    fmt = (format or os.path.splitext(file.filename or "")[1].lstrip(".")).lower()
+    if fmt not in FORMATS:
+        return {"msg": f"Error: Unsupported file format, expected one of {', '.join(FORMATS)}"}
 
-    return {"msg": "success", "Question ID": id}
+    result = await runDB(importQA, file.file, fmt, logger_qaAdmin)
+    summary = {"QA": result["qa"], "questions": result["questions"], "skipped": result["skipped"]}
+    # The questions are embedded by the background jobs; every worker syncs them as they complete
+    if result["qa"] > 0:
+        wakeRunner()
+    if result["error"]:
+        return {"msg": result["error"], **summary}
+    return {"msg": "success", **summary}
 
 @router.patch("/QA/{id}")
 async def updateQA(id: int, params: QA_params):
-    id = str(id)
     if len(params.question) == 0:
         return {"msg": "Error: At least one question must be provided in a question list!"}
 
     # Check if given id exists in QA table
-    data = getQuestionAnswer(id)
+    data = await runDB(getQuestionAnswer, id, logger_qaAdmin)
     if data == False:
         return {"msg": "An error occurred while fetching a data from QA table"}
     elif data == None:
         return {"msg": "Given id does not exist in QA table!"}
     
-    list_q = []  # Will append processed questions
     # Preproceed a list of questions
-    for q in params.question:
-        q = q.lower().strip()
-        # Remove some punctuations
-        for punc in ["?", "？", "!", "！"]:
-            if punc in q:
-                q = q.replace(punc, "")
-        # Replace some punctuations
-        for punc, punc_new in {",": "，", "(": "（", ")": "）"}.items():
-            if punc in q:
-                q = q.replace(punc, punc_new)
-
-        list_q.append(q)
+    list_q = [normalize_text(q) for q in params.question]
 
     
-    status = updateQuestionAnswer(id, list_q, params.answer, logger_qaAdmin)
-    if not status:
+    # The QA row and its embedding job are committed together
+    job_id = await runDB(updateQuestionAnswer, id, list_q, params.answer, logger_qaAdmin)
+    if job_id is None:
         return {"msg": "An error occurred while updating data into QA table"}
 
+    # The previous questions keep being served until the job has embedded the new ones
+    wakeRunner()
 
-    model = SentenceBert()
-    # Embed questions
-    arr_q_embedded = model(list_q)
-    list_ques_embedded = []
-    for Q, embedded in zip(list_q, arr_q_embedded):
-        list_ques_embedded.append(Q)
-        list_ques_embedded.append(pickle.dumps(embedded))
-
-    # Delete all questions related to the same answer in the QA embedding table
-    status = deleteQuestionEmbedding(qid=id, logger=logger_qaAdmin)
-    if not status:
-        return {"msg": "An error occurred while deleting data from QA embedding table"}
-    
-    # Then insert newly embedded contents
-    list_data = [{"qid": id, "question": q, "answer": params.answer, "question_embed": json.dumps(arr_q_embedded)} for q in list_q]
-    status = createQuestionEmbedding(list_data, logger_qaAdmin)
-    if not status:
-        return {"msg": "An error occurred while inserting data into QA embedding table"}
-
-    # Reload data
-    try:
-        response = requests.get(f"http://{os.getenv('LOCALHOST')}:80/chatbot/hr/ReLoad")
-        logger_qaAdmin.info(f"response: {response}, response.text: {response.text}")
-    except:
-        logger_qaAdmin.exception("Something goes wrong while sending a request to API 'ReLoad'")
-        return {"msg": "An error occurred while reloading data from tables"}
+    return {"msg": "success", "Job ID": job_id}
 
-    return {"msg": "success"}
 
+@router.get("/jobs/{id}")
+async def getJobById(id: int):
+    """
+        Fetch the status of an embedding job: pending, running, done or failed
+        (with the error of its last attempt)
+    """
+    data = await runDB(getEmbeddingJob, id, logger_qaAdmin)
+    if data == False:
+        return {"msg": "An error occurred while fetching a data from embedding job table"}
+    elif data == None:
+        return {"msg": "Given id does not exist in embedding job table!"}
+    return data
 
 @router.delete("/QA/{id}")
 async def deleteQA(id: int):
-    status = deleteQuestionAnswer(id)
-    if not status:
-        return {"msg": "An error occurred while deleting a data from QA table"}
-    # Reload data
-    try:
-        response = requests.get(f"http://{os.getenv('LOCALHOST')}:80/chatbot/hr/ReLoad")
-        logger_qaAdmin.info(f"response: {response}, response.text: {response.text}")
-    except:
-        logger_qaAdmin.exception("Something goes wrong while sending a request to API 'ReLoad'")
-        return {"msg": "An error occurred while reloading data from tables"}
+    # The QA pair, its embeddings and the version bump are committed together
+    version = await runDB(deleteQuestionAnswer, id, logger_qaAdmin)
+    if version is None:
+        return {"msg": "An error occurred while deleting a data from QA tables"}
+
+    # Remove the questions from the in-memory index
+    chatbotAPI.removeQA(id)
+    chatbotAPI.markVersion(version)
     return {"msg": "success"}
 
 @router.post("/QA/all")
 async def deleteAllQA():
-    status = deleteAllQuestionAnswer(logger_qaAdmin)
-    if not status:
-        return {"msg": "An error occurred while deleting all data from QA table"}
+    # Both tables and the version bump are committed together
+    version = await runDB(deleteAllQuestionAnswer, logger_qaAdmin)
+    if version is None:
+        return {"msg": "An error occurred while deleting all data from QA tables"}
+
+    # Empty the in-memory index
+    chatbotAPI.clearQA()
+    chatbotAPI.markVersion(version)
+    return {"msg": "success"}
 
-    # Reload data
+@router.post("/QA/reembed")
+async def reembedQA():
+    """
+        Embed the whole QA bank again with the encoder of this worker (config.encoder_model), e.g. after
+        switching ENCODER_BACKEND: the stored embeddings are dropped and every QA pair gets an embedding job.
+        The workers reload the bank, which fills up as the jobs complete.
+    """
+    result = await runDB(reembedQuestionAnswer, encoderId(), logger_qaAdmin)
+    if result is None:
+        return {"msg": "An error occurred while switching the encoder of QA bank"}
+    version, n_job = result
+    # Reload here right away (the other workers pick up the reload at their next version check), then embed
+    await chatbotAPI.loadData()
+    wakeRunner()
+    return {"msg": "success", "encoder": encoderId(), "jobs": n_job, "version": version}
+
+
+class profiling_params(BaseModel):
+    enabled: bool
+    sample_rate: float = Field(config.profiling["sample_rate"], ge=0, le=1)
+
+@router.get("/profiling")
+async def getProfiling():
+    """
+        Profiling settings and the request profiles kept on this host, newest first
+    """
+    return {**profiling.getSettings(), "profiles": profiling.listProfiles()}
+
+@router.put("/profiling")
+async def setProfiling(params: profiling_params):
+    """
+        Switch sampled profiling of /chatbot/ask and /manage/* on or off, for every worker of this host
+    """
     try:
-        response = requests.get(f"http://{os.getenv('LOCALHOST')}:80/chatbot/hr/ReLoad")
-        logger_qaAdmin.info(f"response: {response}, response.text: {response.text}")
+        return {"msg": "success", **profiling.saveSettings(params.enabled, params.sample_rate)}
     except:
-        logger_qaAdmin.exception("Something goes wrong while sending a request to API 'ReLoad'")
-        return {"msg": "An error occurred while reloading data from tables"}
-    return {"msg": "success"}
+        logger_qaAdmin.exception("An error occurred while saving profiling settings")
+        return {"msg": "An error occurred while saving profiling settings"}
 
+@router.get("/profiling/{name}")
+async def getProfile(name: str, format: Optional[str] = None, sort: str = "cumulative", limit: int = 50):
+    """
+        Download a request profile (pstats file), or with format=text read its heaviest functions
+    """
+    path = profiling.profilePath(name)
+    if path is None:
+        return {"msg": "Given profile does not exist!"}
+    if format == "text":
+        if sort not in profiling.SORT_KEYS:
+            return {"msg": f"Error: Unknown sort key, expected one of {', '.join(profiling.SORT_KEYS)}"}
+        try:
+            return PlainTextResponse(profiling.renderProfile(path, sort, limit))
+        except:
+            logger_qaAdmin.exception(f"An error occurred while reading profile {name}")
+            return {"msg": "An error occurred while reading the profile"}
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
@@ -1,128 +1,555 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter
 from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional
+import asyncio
+import time
 import numpy as np
-import pandas as pd
-from ..model_func import SentenceBert, calculate_similarity_index
-from ..database.mysql_funcs import getAllQuestionEmbedding
+from ..model_func import EncoderScheduler, QuestionIndex, get_model, normalize_text, warmup_model
+from ..database.mysql_funcs import runDB, closePool, getAllQuestionEmbeddingMatrix, getQuestionEmbeddingByQids, getQAVersion, getQAChanges
+from ..database.redis_funcs import ResponseCache, SessionStore
+from ..snapshot import loadSnapshot
+from ..encoders import encoderId
+from ..answer_store import AnswerStore
+from ..ivf_index import IVFIndex
 from .. import config
+from .. import metrics
 from .. import logger
 
 router = APIRouter()
 logger_chatbotAPI = logger.setForWritefile("chatbotAPI", "app/logs/chatbotAPI.log")
+# Dialogue state and offered candidates of each user, shared by the workers through Redis
+sessions = SessionStore(logger_chatbotAPI)
+# Results of /chatbot/ask per (normalized question, QA bank version)
+response_cache = ResponseCache(logger_chatbotAPI)
 
-df_data = pd.DataFrame()
-arr_questions = np.array()
+# qid, question and answer of every row of the index
+store = AnswerStore.empty()
+index = QuestionIndex([])
+# Normalized question text -> (qid, answer), so verbatim questions are answered without the encoder
+exact_match = {}
+# QA bank version (see mysql_funcs.getQAVersion) the in-memory data is up to date with
+bank_version = 0
+# False while the in-memory data has writes applied beyond bank_version (see markVersion)
+data_clean = True
+last_version_check = 0.0
+sync_lock = asyncio.Lock()
+# True while the stored embeddings were computed by another encoder than this worker's (see loadData)
+encoder_mismatch = False
 
 model = None
+encoder = None
+# True once the data is loaded and the encoder warmed up in this worker (GET /ready)
+ready = False
+# True if the data was loaded by preload() before the workers were forked
+preloaded = False
 state = {
     "completed": "completed",
     "waitForFirstResponse": "waitForFirstResponse",
     "waitForSecondResponse": "waitForSecondResponse"
 }
 
+def readData(rebuild=False):
+    """
+        Read embedded QA data and build a new question index, without touching the in-memory data
+        (blocking; run it on a thread with runDB, loadData then swaps the result in on the event loop)
+        With config.snapshot_path set, the embeddings are memory-mapped from the snapshot shared by
+        all workers of the host, which is (re)built from MySQL only when it is missing or stale.
+        Embeddings computed by another encoder than this worker's are refused: their similarities
+        to the queries would be meaningless (see POST /manage/QA/reembed).
+        Inputs:
+            rebuild (bool): Rebuild the snapshot even if it is up to date
+        Returns:
+            version (int): QA bank version of the data
+            data (tuple): (store, index, exact_match) to swap in, None if the encoder does not match
+            False if there is an error
+    """
+    if config.snapshot_path:
+        # If MySQL is unreachable (None), any existing snapshot is served and syncData() catches up later
+        version = getQAVersion(logger_chatbotAPI)
+        snapshot = loadSnapshot(config.snapshot_path, version, logger_chatbotAPI, rebuild=rebuild)
+        if snapshot is False:
+            return False
+        new_version, stored_encoder = snapshot.version, snapshot.encoder
+    else:
+        result = getAllQuestionEmbeddingMatrix(logger_chatbotAPI)
+        if result is False:
+            return False
+        dict_data, arr_emb, new_version, stored_encoder = result
+    if stored_encoder is not None and stored_encoder != encoderId():
+        logger_chatbotAPI.error(f"The QA bank is embedded by encoder {stored_encoder}, not {encoderId()} of this worker: "
+                                f"not loaded; switch back or re-embed it (POST /manage/QA/reembed)")
+        return new_version, None
+    if config.snapshot_path:
+        new_store = AnswerStore.from_rows(snapshot.qids, snapshot.questions(), snapshot.answers())
+        new_index = QuestionIndex.from_normalized(snapshot.embeddings, snapshot.qids)
+    else:
+        new_store = AnswerStore.from_rows(dict_data["qid"], dict_data["question"], dict_data["answer"])
+        new_index = QuestionIndex(arr_emb, qids=dict_data["qid"])
+    attachIVF(new_index, new_version)
+    return new_version, (new_store, new_index, buildExactMatch(new_store))
+
+def swapData(result):
+    """
+        Replace the in-memory data by the data read by readData
+        Call it on the event loop (or before it runs): the writes applied in place (upsertQA, removeQAs)
+        and the asks also run there, so they never see the data change under them.
+        Returns:
+            True if the data was swapped in
+    """
+    global store, index, bank_version, exact_match, data_clean, encoder_mismatch
+    if result is False:
+        return False
+    new_version, data = result
+    encoder_mismatch = data is None
+    if encoder_mismatch:
+        # Checked again at the next change of the QA bank (syncData), not at every version check
+        bank_version = new_version
+        return False
+    store, index, exact_match = data
+    bank_version, data_clean = new_version, True
+    updateIndexMetrics()
+    return True
+
+async def loadData(rebuild=False):
+    """
+        Load embedded QA data and build the in-memory question index: read on the database thread
+        pool, swapped in on the event loop
+        Inputs:
+            rebuild (bool): Rebuild the snapshot even if it is up to date
+        Returns:
+            True if the data was loaded
+    """
+    return swapData(await runDB(readData, rebuild=rebuild))
+
+def buildExactMatch(store):
+    """
+        Map every normalized question of an AnswerStore to the qid and answer of its QA pair
+    """
+    return {question: (qid, store.answers[qid]) for qid, question in zip(store.qids.tolist(), store.questions)}
+
+def dropExactMatch(list_question, list_qid):
+    """
+        Remove questions of QA pairs from exact_match (entries since taken over by another QA pair are kept)
+        Inputs:
+            list_question (array-like): Removed questions
+            list_qid (array-like): qid of every removed question
+    """
+    for question, qid in zip(list_question, np.asarray(list_qid).tolist()):
+        if exact_match.get(question, (None,))[0] == qid:
+            del exact_match[question]
+
+def attachIVF(index, version):
+    """
+        Switch a question index to approximate search when config.index_mode is "ivf" and the bank is large
+        The clusters are loaded from config.ivf["path"] when they match the loaded data, otherwise built and saved.
+        Inputs:
+            index (QuestionIndex): Index of the QA bank
+            version (int): QA bank version of the index
+    """
+    if config.index_mode != "ivf" or len(index) < config.ivf["min_rows"]:
+        return
+    ivf = IVFIndex.load(config.ivf["path"], version, len(index))
+    if ivf is None:
+        ivf = IVFIndex.build(index.dequantize(), n_lists=config.ivf["n_lists"], n_iter=config.ivf["n_iter"])
+        try:
+            ivf.save(config.ivf["path"], version)
+        except:
+            logger_chatbotAPI.exception("An error occurred while saving the IVF index")
+        logger_chatbotAPI.info(f"Built IVF index with {ivf.centroids.shape[0]} clusters over {len(index)} questions")
+    index.ivf = ivf
+    index.n_probe = config.ivf["n_probe"]
+
+def updateIndexMetrics():
+    """
+        Export the size and QA bank version of this worker's in-memory index
+    """
+    metrics.INDEX_QUESTIONS.set(len(index))
+    metrics.INDEX_VERSION.set(bank_version)
+
+def upsertQA(qid, list_q, answer, arr_emb):
+    """
+        Apply a created or updated QA pair to the in-memory data without reloading the tables
+        Inputs:
+            qid (int): ID of the QA pair
+            list_q (list): Normalized questions of the QA pair
+            answer (str): Answer of the QA pair
+            arr_emb (ndarray): Embeddings of list_q
+    """
+    global data_clean
+    qid = int(qid)
+    data_clean = False
+    keep = index.replace(qid, arr_emb)
+    dropExactMatch(store.questions[~keep], store.qids[~keep])
+    for question in list_q:
+        exact_match[question] = (qid, answer)
+    # Keep the rows of the store aligned with the rows of the index
+    store.upsert(keep, qid, list(list_q), answer)
+    updateIndexMetrics()
+
+def removeQA(qid):
+    """
+        Remove a deleted QA pair from the in-memory data without reloading the tables
+    """
+    removeQAs([qid])
+
+def removeQAs(list_qid):
+    """
+        Remove several QA pairs from the in-memory data, compacting the index once for all of them
+    """
+    global data_clean
+    list_qid = [int(qid) for qid in list_qid]
+    if not list_qid:
+        return
+    data_clean = False
+    keep = index.remove_qids(list_qid)
+    dropExactMatch(store.questions[~keep], store.qids[~keep])
+    store.remove(keep, list_qid)
+    updateIndexMetrics()
+
+def clearQA():
+    """
+        Drop all in-memory QA data after every QA pair was deleted
+    """
+    global store, index, data_clean
+    data_clean = False
+    store = AnswerStore.empty()
+    index = QuestionIndex([], dim=index.matrix.shape[1])
+    exact_match.clear()
+    updateIndexMetrics()
+
+def markVersion(version):
+    """
+        Record the QA bank version of a write this worker has already applied in place
+        If other writes happened in between, the version is left for syncData() to catch up.
+    """
+    global bank_version, data_clean
+    if version is not None and version == bank_version + 1:
+        bank_version = version
+        data_clean = True
+        updateIndexMetrics()
+
+def cacheVersion():
+    """
+        QA bank version to key cached responses with, or None if responses must not be cached now
+        (the in-memory data is ahead of bank_version until syncData() catches up)
+    """
+    return bank_version if data_clean and config.response_cache["enabled"] else None
+
+async def syncData():
+    """
+        Bring the in-memory data up to date with writes made through other workers
+        The QA bank version in MySQL is checked at most once per config.version_check_ttl seconds,
+        and only the QA pairs changed since the last known version are fetched.
+    """
+    global bank_version, last_version_check, data_clean
+    now = time.monotonic()
+    if now - last_version_check < config.version_check_ttl or sync_lock.locked():
+        return
+    async with sync_lock:
+        last_version_check = now
+        version = await runDB(getQAVersion, logger_chatbotAPI)
+        if version is None or version <= bank_version:
+            return
+        list_change = await runDB(getQAChanges, bank_version, logger_chatbotAPI)
+        if not list_change:
+            return
+        # After a refused load, only a full load checks the encoder again
+        if (encoder_mismatch or len(list_change) > config.sync_max_changes
+                or any(change["op"] == "reload" for change in list_change)):
+            # Too many changes to apply one by one (e.g. a bulk import): load everything again
+            if await loadData():
+                logger_chatbotAPI.info(f"Reloaded QA data at version {bank_version}")
+            return
+
+        # Only the latest change of each QA pair matters, and a clear drops everything before it
+        cleared = False
+        dict_op = {}
+        for change in list_change:
+            if change["op"] == "clear":
+                cleared = True
+                dict_op = {}
+            else:
+                dict_op[change["qid"]] = change["op"]
+        list_upsert = [qid for qid, op in dict_op.items() if op == "upsert"]
+        result = await runDB(getQuestionEmbeddingByQids, list_upsert, logger_chatbotAPI)
+        if result is False:
+            return
+        dict_data, arr_emb = result
+
+        # Apply everything without awaiting in between, so no ask sees a half-applied state
+        if cleared:
+            clearQA()
+        # Every changed QA pair leaves the index in a single compaction, then the upserted ones are appended
+        # (one deleted again after its upsert was logged stays out; its delete comes with a later version)
+        removeQAs(list(dict_op))
+        for qid in list_upsert:
+            rows = dict_data["qid"] == qid
+            if rows.any():
+                upsertQA(qid, dict_data["question"][rows].tolist(), dict_data["answer"][rows][0], arr_emb[rows])
+        bank_version = list_change[-1]["version"]
+        data_clean = True
+        updateIndexMetrics()
+        logger_chatbotAPI.info(f"Synced {len(list_change)} QA changes up to version {bank_version}")
+
+def preload():
+    """
+        Load the encoder weights and the QA data once in the gunicorn master (config.preload_app),
+        so the forked workers share those pages copy-on-write instead of each loading a copy.
+        No forward pass runs here: every worker warms up its encoder (and its threads) after the fork.
+    """
+    global model, preloaded
+    model = get_model()
+    preloaded = swapData(readData())
+    # The workers open their own connections
+    closePool()
+
 @router.on_event("startup")
 async def startup_event():
     # Preload data
-    global df_data, arr_questions, model
-    df_data = getAllQuestionEmbedding(logger_chatbotAPI)
-    arr_questions = df_data["question"].values()
-    model = SentenceBert()
+    global model, encoder, ready
+    if preloaded:
+        # Only the QA writes made since the master loaded the data
+        await syncData()
+    else:
+        await loadData()
+    model = warmup_model()
+    # Some FastAPI versions run router startup handlers twice; keep a single scheduler
+    if encoder is None:
+        encoder = EncoderScheduler(model)
+    encoder.start()
+    ready = True
 
 
 @router.on_event("shutdown")
 async def shutdown_event():
-    pass
+    global encoder, ready
+    ready = False
+    if encoder is not None:
+        await encoder.stop()
+        encoder = None
 
 @router.get("/chatbot/welcome")
 async def welcome():
-    text += "Hello! Welcome to ask me some questions! I will do my best to give you satisfactory responses!"
+    text = "Hello! Welcome to ask me some questions! I will do my best to give you satisfactory responses!"
     return await responseReturn(uid=None, text=text, option=[], newState=None)
 
 
 @router.get("/chatbot/reload")
 async def ReloadData():
     """
-        Manually reload embedded QA data
+        Manually reload embedded QA data (for recovery; admin writes update the data in place)
     """
-    global df_data
-    df_data = getAllQuestionEmbedding(logger_chatbotAPI)
-    arr_questions = df_data["question"].values()
+    if not await loadData(rebuild=True):
+        return {"msg": "An error occurred while fetching all data from QA embedding table"}
     return {"msg": "Reload successful"}
 
-class userText(userInfo):
+class userText(BaseModel):
     uid: str = Field(..., min_length=1, max_length=15)
     ask_text: str = Field(..., title="Ask something to our bot ^^", min_length=1, max_length=250)
-    state: str = Field(..., min_length=1, max_length=15)
+    # Only used when the server has no session for uid (e.g. it expired)
+    state: Optional[str] = Field(None, min_length=1, max_length=20)
 
-@router.post("/chatbot/ask", dependencies=[Depends(startup_event)])
+def selectedQid(ask_text, session):
+    """
+        The qid a user picked in a WaitingForSelection turn
+        Returns:
+            qid (int), or None if ask_text is not one of the candidates offered to the user
+    """
+    try:
+        qid = int(ask_text)
+    except ValueError:
+        return None
+    if session is not None and qid not in session["qids"]:
+        return None
+    return qid if qid in store.answers else None
+
+@router.post("/chatbot/ask")
 async def response(user: userText):
-    uid = user.uid
-    ask_text = user.ask_text
-    state = user.state
-    k = 7
+    with metrics.timeStage("session"):
+        session = await sessions.get(user.uid)
+    result = await reply(user, session)
 
-    if (state == None) or (state == "Asking"):
-        # Preproceed ask_text string
-        ask_text = ask_text.lower().strip()
-        # Remove some punctuations
-        for punc in ["?", "？", "!", "！"]:
-            if punc in ask_text:
-                ask_text = ask_text.replace(punc, "")
-        # Replace some punctuations
-        for punc, punc_new in {",": "，", "(": "（", ")": "）"}.items():
-            if punc in ask_text:
-                ask_text = ask_text.replace(punc, punc_new)
-        
-        # Text to Embedding
-        ask_emb = model([ask_text])
+    # Remember where the dialogue stands; the options of a selection are the candidate qids
+    with metrics.timeStage("session"):
+        if result["newState"] in ("WaitingForFeedback", "WaitingForSelection"):
+            qids = [qid for qid in result["option"] if isinstance(qid, int)]
+            await sessions.set(user.uid, {"state": result["newState"], "qids": qids})
+        elif session is not None:
+            await sessions.delete(user.uid)
+    return result
 
-        # Calculate similarities between user input sentence and question banks
-        idx_sorted, arr_similarities = calculate_similarity_index(target=ask_emb,
-                                                                  pool=ask_text,
-                                                                 )
+class batchText(BaseModel):
+    ask_texts: List[Annotated[str, Field(min_length=1, max_length=250)]] = Field(..., min_length=1, max_length=config.ask_batch_max)
 
-        # Get an answer corresponding to the matched question
-        text = df_data.iloc[idx_sorted[0]]["answer"]
-        
+@router.post("/chatbot/ask/batch")
+async def responseBatch(batch: batchText):
+    """
+        Answer many independent questions at once, each as /chatbot/ask answers a new question
+        (nothing is kept in the sessions). Every item also gets its top similarity and the
+        candidate questions (best question of each QA pair) the response was decided on.
+        The questions are encoded in one call of the model and scored with one matrix product.
+    """
+    # Pick up QA writes made through other workers
+    await syncData()
+    list_text = [normalize_text(ask_text) for ask_text in batch.ask_texts]
+
+    dict_item = {}
+    for text in list_text:
+        # A verbatim question of our question bank is answered directly
+        match = exact_match.get(text)
+        if match is not None:
+            dict_item[text] = {"text": match[1], "option": [], "newState": "Completed", "similarity": 1.0,
+                               "candidates": [{"qid": match[0], "question": text, "similarity": 1.0}]}
+    # Every other distinct question is encoded and scored once
+    list_unique = [text for text in dict.fromkeys(list_text) if text not in dict_item]
+    if list_unique:
+        with metrics.timeStage("batch_encode"):
+            arr_emb = await encoder.encode_list(list_unique)
+        with metrics.timeStage("batch_search"):
+            arr_idx, arr_sim = index.search_batch(arr_emb, config.top, by_qid=config.retrieval_mode == "answer")
+        for text, idx_topK, arr_similarities in zip(list_unique, arr_idx, arr_sim):
+            dict_item[text] = {**decideAnswer(idx_topK, arr_similarities),
+                               "similarity": float(arr_similarities[0]) if len(arr_similarities) else None,
+                               "candidates": listCandidates(idx_topK, arr_similarities)}
+
+    return {"threshold": config.threshold, "second_threshold": config.second_threshold,
+            "data": [{"ask_text": ask_text, **dict_item[text]} for ask_text, text in zip(batch.ask_texts, list_text)]}
+
+def listCandidates(idx_topK, arr_similarities):
+    """
+        The best matching question of each QA pair among the most similar rows, most similar first
+    """
+    dict_candidate = {}
+    for idx, similarity in zip(idx_topK.tolist(), arr_similarities.tolist()):
+        qid = store.qid(idx)
+        if qid not in dict_candidate:
+            dict_candidate[qid] = {"qid": qid, "question": store.questions[idx], "similarity": similarity}
+    return list(dict_candidate.values())
+
+async def answerQuestion(ask_text, k):
+    """
+        Find the answer to a new question by similarity to the questions of the QA bank
+        Inputs:
+            ask_text (str): Normalized question
+            k (int): Number of most similar questions to consider
+        Returns:
+            result (dict): "text", "option" and "newState" of the response
+    """
+    # Text to Embedding
+    with metrics.timeStage("encode"):
+        ask_emb = await encoder.encode([ask_text])
+
+    # Find the top k questions most similar to user input sentence in question banks
+    with metrics.timeStage("search"):
+        idx_topK, arr_similarities = index.search(ask_emb, k, by_qid=config.retrieval_mode == "answer")
+    return decideAnswer(idx_topK, arr_similarities)
+
+def decideAnswer(idx_topK, arr_similarities):
+    """
+        Turn the most similar questions of a new question into a response, by comparing the
+        top similarity with config.threshold and config.second_threshold
+        Inputs:
+            idx_topK (ndarray): Row indices of the most similar questions, most similar first
+            arr_similarities (ndarray): Similarities of those rows
+        Returns:
+            result (dict): "text", "option" and "newState" of the response
+    """
+    if len(idx_topK) == 0:
+        text = f"Sorry, I'm not clear what you ask, would you please change a way to ask your question."
+        return {"text": text, "option": [], "newState": "Asking"}
+
+    # Get an answer corresponding to the matched question
+    with metrics.timeStage("answer_lookup"):
+        text = store.answer(idx_topK[0])
+    
+    with metrics.timeStage("branch"):
         # If the top 1's similarity is 1, which exactly matches a question in our question bank
-        if arr_similarities[idx_sorted[0]] == 1:
+        # (float32 scores of identical unit vectors may be off by one ulp)
+        if np.isclose(arr_similarities[0], 1):
             # Set a new state
             newState = "Completed"
-            return await responseReturn(uid=uid, text=text, option=[], newState=newState)
+            return {"text": text, "option": [], "newState": newState}
         # If the top 1's similarity is over the threshold
-        elif arr_similarities[idx_sorted[0]] >= config.threshold:
+        elif arr_similarities[0] >= config.threshold:
             text = text + f"\nAre you satisfied with my response?"
             # Set a new state and option
             newState = "WaitingForFeedback"
             option = ["Yes", "No"]
-            return await responseReturn(uid=uid, text=text, option=option, newState=newState)
-        elif arr_similarities[idx_sorted[0]] >= config.second_threshold:
+            return {"text": text, "option": option, "newState": newState}
+        elif arr_similarities[0] >= config.second_threshold:
             text = f"Sorry, I'm not sure what you ask, so I find the following similar questions for you:\n"
-            
+        
             # Set a new state and option
             newState = "WaitingForSelection"
-            # List top k similar questions for user to choose
-            arr_topK_indices = idx_sorted[:k]
-            option = arr_topK_indices.tolist()
+            # List top k similar questions for user to choose, the best matching question of each QA pair;
+            # options are qids, which stay valid when the data is reloaded
+            dict_candidate = {}
+            for idx in idx_topK.tolist():
+                dict_candidate.setdefault(store.qid(idx), store.questions[idx])
+            option = list(dict_candidate)
             option.append("None of the above")
 
-            text += "\n * ".join(arr_questions[arr_topK_indices].tolist())
+            text += "\n * ".join(dict_candidate.values())
             text += "* None of the above"
 
-            return await responseReturn(uid=uid, text=text, option=option, newState=newState)
-        else:  # arr_similarities[idx_sorted[0]] < config.second_threshold
+            return {"text": text, "option": option, "newState": newState}
+        else:  # arr_similarities[0] < config.second_threshold
             text = f"Sorry, I'm not clear what you ask, would you please change a way to ask your question."
-            
+        
             # Set a new state
             newState = "Asking"
-            return await responseReturn(uid=uid, text=text, option=[], newState=newState)
+            return {"text": text, "option": [], "newState": newState}
+
+async def reply(user, session):
+    """
+        Answer one message of a user given their session (None if there is none)
+    """
+    uid = user.uid
+    ask_text = user.ask_text
+    # The session kept by the server takes precedence over the state echoed by the client
+    state = session["state"] if session is not None else user.state
+    k = config.top
+
+    # Pick up QA writes made through other workers
+    with metrics.timeStage("sync"):
+        await syncData()
+
+    # A message that is not one of the offered options is a new question
+    if state == "WaitingForSelection" and ask_text != "None of the above" and selectedQid(ask_text, session) is None:
+        state = "Asking"
+    elif state == "WaitingForFeedback" and ask_text not in ("Yes", "No"):
+        state = "Asking"
+
+    if state in (None, "Asking", "Completed"):
+        # Preproceed ask_text string
+        with metrics.timeStage("normalize"):
+            ask_text = normalize_text(ask_text)
+
+        # A verbatim question of our question bank is answered directly, without encoding and searching
+        with metrics.timeStage("exact_match"):
+            match = exact_match.get(ask_text)
+        if match is not None:
+            return await responseReturn(uid=uid, text=match[1], option=[], newState="Completed")
+        
+        # The result only depends on the question and the QA bank, so repeated questions are served from the cache
+        version = cacheVersion()
+        result = None
+        if version is not None:
+            with metrics.timeStage("response_cache"):
+                result = await response_cache.get(ask_text, version)
+            (metrics.RESPONSE_CACHE_MISSES if result is None else metrics.RESPONSE_CACHE_HITS).inc()
+        if result is None:
+            result = await answerQuestion(ask_text, k)
+            # Not cached if the QA bank changed while answering
+            if version is not None and version == cacheVersion():
+                await response_cache.set(ask_text, version, result)
+        return await responseReturn(uid=uid, **result)
     elif state == "WaitingForSelection":
-        # ask_text should be a string number indicating an index of a question, or "None of the above"
+        # ask_text is the qid of one of the offered questions, or "None of the above"
         if ask_text == "None of the above":
             text = f"I'm sorry that my response couldn't help you. Please forgive me that I'm still learning to be a better assistant."
         else:
-            idx = int(ask_text)
-            text = df_data.iloc[idx]["answer"]
+            text = store.answers[selectedQid(ask_text, session)]
         
         newState = "Completed"
         return await responseReturn(uid=uid, text=text, option=[], newState=newState)
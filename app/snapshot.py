@@ -0,0 +1,202 @@
+# On-disk snapshot of the embedded QA bank, shared by every worker on a host.
+# One file holds the L2-normalized float32 embedding matrix, the qid of every row, and the
+# question and answer texts (UTF-8 bytes plus offsets), tagged with the QA bank version and the
+# encoder (encoders.encoderId) of the embeddings. Workers open it with np.memmap in
+# read-only mode, so they all map the same page cache instead of each loading from MySQL.
+# Layout: MAGIC | uint64 header length | JSON header | padding | 64-byte aligned arrays
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from logging import Logger
+import numpy as np
+from .model_func import normalize_rows
+from .database.mysql_funcs import getAllQuestionEmbeddingMatrix
+
+MAGIC = b"QASNAP01"
+ALIGNMENT = 64
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _encodeTexts(list_text):
+    """
+        Concatenate texts as UTF-8 and return (bytes array, offsets array of length n + 1)
+    """
+    list_bytes = [str(text).encode("utf-8") for text in list_text]
+    arr_offsets = np.zeros(len(list_bytes) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in list_bytes], out=arr_offsets[1:])
+    arr_bytes = np.frombuffer(b"".join(list_bytes), dtype=np.uint8)
+    return arr_bytes, arr_offsets
+
+def writeSnapshot(path, arr_emb, arr_qid, list_question, list_answer, version, encoder=None):
+    """
+        Write a snapshot atomically: the file is written under a temporary name in the
+        same directory, fsynced, then renamed over path
+        Inputs:
+            path (str): Snapshot file
+            arr_emb (ndarray): L2-normalized embeddings of shape (n, dim)
+            arr_qid (ndarray): qid of every row
+            list_question (list): Question of every row
+            list_answer (list): Answer of every row
+            version (int): QA bank version the data corresponds to
+            encoder (str): encoders.encoderId of the encoder that computed the embeddings
+    """
+    question_bytes, question_offsets = _encodeTexts(list_question)
+    answer_bytes, answer_offsets = _encodeTexts(list_answer)
+    dict_array = {
+        "embeddings": np.ascontiguousarray(arr_emb, dtype="<f4"),
+        "qids": np.ascontiguousarray(arr_qid, dtype="<i8"),
+        "question_offsets": question_offsets.astype("<i8"),
+        "question_bytes": question_bytes,
+        "answer_offsets": answer_offsets.astype("<i8"),
+        "answer_bytes": answer_bytes,
+    }
+
+    # Offsets are relative to the start of the data section, which follows the header
+    header = {"version": int(version), "encoder": encoder, "arrays": {}}
+    offset = 0
+    for name, arr in dict_array.items():
+        offset = _align(offset)
+        header["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".qa_snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header_bytes)).tobytes())
+            f.write(header_bytes)
+            for name, arr in dict_array.items():
+                f.seek(data_start + header["arrays"][name]["offset"])
+                f.write(arr.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+class Snapshot:
+    """
+        Read-only view of a snapshot file; arrays are memory-mapped, nothing is copied
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a QA snapshot")
+            header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_length))
+        data_start = _align(len(MAGIC) + 8 + header_length)
+
+        self.path = path
+        self.version = header["version"]
+        self.encoder = header.get("encoder")
+        self.arrays = {}
+        for name, meta in header["arrays"].items():
+            shape = tuple(meta["shape"])
+            if int(np.prod(shape)) == 0:
+                # np.memmap cannot map zero bytes
+                self.arrays[name] = np.empty(shape, dtype=meta["dtype"])
+            else:
+                self.arrays[name] = np.memmap(path, dtype=meta["dtype"], mode="r",
+                                              offset=data_start + meta["offset"], shape=shape)
+
+    def __len__(self):
+        return self.arrays["qids"].shape[0]
+
+    @property
+    def embeddings(self):
+        return self.arrays["embeddings"]
+
+    @property
+    def qids(self):
+        return self.arrays["qids"]
+
+    def _text(self, name, i):
+        arr_offsets = self.arrays[f"{name}_offsets"]
+        return bytes(self.arrays[f"{name}_bytes"][arr_offsets[i]:arr_offsets[i + 1]]).decode("utf-8")
+
+    def question(self, i):
+        return self._text("question", i)
+
+    def answer(self, i):
+        return self._text("answer", i)
+
+    def questions(self):
+        return np.array([self.question(i) for i in range(len(self))], dtype=object)
+
+    def answers(self):
+        return np.array([self.answer(i) for i in range(len(self))], dtype=object)
+
+@contextmanager
+def _fileLock(path):
+    """
+        Exclusive lock shared by every process on the host, so only one of them builds a snapshot
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def openSnapshot(path):
+    """
+        Open the snapshot at path; None if it does not exist or cannot be read
+    """
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError):
+        return None
+
+def buildSnapshot(path, logger: Logger):
+    """
+        Build a snapshot from the QA embedding table and write it to path
+        Returns:
+            snapshot (Snapshot): The new snapshot, opened read-only
+            False if there is an error
+    """
+    result = getAllQuestionEmbeddingMatrix(logger)
+    if result is False:
+        return False
+    dict_data, arr_emb, version, encoder = result
+    try:
+        writeSnapshot(path, normalize_rows(arr_emb) if len(arr_emb) else arr_emb,
+                      dict_data["qid"], dict_data["question"], dict_data["answer"], version, encoder)
+    except:
+        logger.exception("An error occurred while writing the QA snapshot")
+        return False
+    logger.info(f"Built QA snapshot {path} at version {version} with {len(arr_emb)} questions")
+    return Snapshot(path)
+
+def loadSnapshot(path, version, logger: Logger, rebuild=False):
+    """
+        Open the snapshot for a QA bank version, building it first if it is missing or stale
+        Concurrent workers wait on a file lock while one of them builds it, then map the same file.
+        Inputs:
+            path (str): Snapshot file
+            version (int): Current QA bank version; None to accept any existing snapshot
+            logger (Logger): A logging object for logging errors
+            rebuild (bool): Rebuild even if the snapshot is up to date
+        Returns:
+            snapshot (Snapshot)
+            False if there is an error
+    """
+    if not rebuild:
+        snapshot = openSnapshot(path)
+        if snapshot is not None and (version is None or snapshot.version == version):
+            return snapshot
+    with _fileLock(path):
+        # Another worker may have built it while this one was waiting for the lock
+        snapshot = openSnapshot(path)
+        if snapshot is not None and not rebuild and (version is None or snapshot.version == version):
+            return snapshot
+        return buildSnapshot(path, logger)
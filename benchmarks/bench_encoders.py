@@ -0,0 +1,99 @@
+# Compare encoder backends (app/encoders.py): load time, encode latency at several batch sizes,
+# and agreement of the embeddings with the first backend (the reference).
+#
+#   python -m benchmarks.bench_encoders --backends sentence-transformers,int8,onnx
+#   python -m benchmarks.bench_encoders --texts questions.txt --batch-sizes 1,8,32
+#
+# Prints one JSON object per backend; a backend that cannot be loaded here reports its error.
+import argparse
+import json
+import os
+import time
+
+# app.config reads these at import time; the benchmark does not talk to any service
+for name in ["MODE", "REDIS_LOGIN_PWD", "MYSQL_LOGIN_PWD", "APP_IP", "APP_PORT", "UI_IP", "UI_PORT"]:
+    os.environ.setdefault(name, "benchmark")
+
+import numpy as np
+from app.encoders import BACKENDS, createEncoder
+from app.model_func import normalize_text
+
+TOPICS = ["gym", "parking", "wifi password", "lunch menu", "meeting room", "printer", "vpn", "payroll",
+          "annual leave", "badge", "elevator", "air conditioning", "coffee machine", "shuttle bus", "mail room"]
+TEMPLATES = ["where is the {}?", "how do i use the {}", "is there a {} on this floor?", "who is in charge of the {}",
+             "the {} is not working, what should i do?", "when does the {} open", "can i book the {} for tomorrow"]
+
+def syntheticTexts(n, seed):
+    """
+        Short questions like those of a QA bank
+    """
+    rng = np.random.default_rng(seed)
+    return [normalize_text(TEMPLATES[rng.integers(len(TEMPLATES))].format(TOPICS[rng.integers(len(TOPICS))]))
+            for _ in range(n)]
+
+def encodeLatency(encoder, list_text, batch_size, repeat):
+    """
+        Milliseconds per call of encoder.encode on consecutive batches of batch_size texts
+    """
+    list_batch = [list_text[start:start + batch_size] for start in range(0, len(list_text), batch_size)]
+    encoder.encode(list_batch[0], batch_size=batch_size)  # warm-up
+    list_latency = []
+    for _ in range(repeat):
+        for batch in list_batch:
+            start = time.perf_counter()
+            encoder.encode(batch, batch_size=batch_size)
+            list_latency.append(time.perf_counter() - start)
+    return np.array(list_latency) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare encoder backends")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends, the first is the reference")
+    parser.add_argument("--texts", help="Optional file of texts, one per line")
+    parser.add_argument("--n", type=int, default=256, help="Number of synthetic texts")
+    parser.add_argument("--batch-sizes", default="1,32")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts) as f:
+            list_text = [normalize_text(line) for line in f if line.strip()]
+    else:
+        list_text = syntheticTexts(args.n, args.seed)
+    # Distinct texts, so that every text has a well-defined nearest other text
+    list_text = list(dict.fromkeys(list_text))
+
+    reference = None
+    for backend in args.backends.split(","):
+        start = time.perf_counter()
+        try:
+            encoder = createEncoder(backend)
+        except Exception as e:
+            print(json.dumps({"backend": backend, "error": repr(e)}))
+            continue
+        load_s = time.perf_counter() - start
+
+        result = {"backend": backend, "load_s": round(load_s, 3)}
+        for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+            arr_latency_ms = encodeLatency(encoder, list_text, batch_size, args.repeat)
+            result[f"batch{batch_size}_ms_p50"] = round(float(np.percentile(arr_latency_ms, 50)), 3)
+            result[f"batch{batch_size}_ms_p95"] = round(float(np.percentile(arr_latency_ms, 95)), 3)
+            result[f"batch{batch_size}_texts_per_s"] = round(batch_size * 1000 / float(np.mean(arr_latency_ms)), 1)
+
+        arr_emb = encoder.encode(list_text, batch_size=32)
+        arr_emb = arr_emb / np.clip(np.linalg.norm(arr_emb, axis=1, keepdims=True), 1e-12, None)
+        if reference is None:
+            reference = arr_emb
+        if arr_emb.shape == reference.shape:
+            # Same vector for the same text, and the same nearest other text in the set
+            arr_cosine = np.sum(arr_emb * reference, axis=1)
+            sim, sim_ref = arr_emb @ arr_emb.T, reference @ reference.T
+            np.fill_diagonal(sim, -np.inf)
+            np.fill_diagonal(sim_ref, -np.inf)
+            result["cosine_to_reference_mean"] = round(float(arr_cosine.mean()), 5)
+            result["cosine_to_reference_min"] = round(float(arr_cosine.min()), 5)
+            result["nearest_agreement"] = round(float(np.mean(sim.argmax(axis=1) == sim_ref.argmax(axis=1))), 4)
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
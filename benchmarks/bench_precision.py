@@ -0,0 +1,78 @@
+# Compare storage precisions of the question matrix (QuestionIndex precision):
+# memory, exact-scan latency, and agreement with float32 results.
+#
+#   python -m benchmarks.bench_precision --n 100000 --queries 200
+#   python -m benchmarks.bench_precision --embeddings questions.npy
+#
+# Prints one JSON object per precision.
+import argparse
+import json
+import os
+import time
+
+# app.config reads these at import time; the benchmark does not talk to any service
+for name in ["MODE", "REDIS_LOGIN_PWD", "MYSQL_LOGIN_PWD", "APP_IP", "APP_PORT", "UI_IP", "UI_PORT"]:
+    os.environ.setdefault(name, "benchmark")
+
+import numpy as np
+from app.model_func import PRECISIONS, QuestionIndex
+
+def syntheticEmbeddings(n, dim, n_topics, seed):
+    """
+        Clustered vectors resembling a question bank: several paraphrases around each topic
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    return topics[rng.integers(0, n_topics, n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare storage precisions of the question matrix")
+    parser.add_argument("--embeddings", help="Optional .npy file of question embeddings (n, dim)")
+    parser.add_argument("--n", type=int, default=100000, help="Number of synthetic questions")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        arr_emb = np.load(args.embeddings).astype(np.float32)
+    else:
+        arr_emb = syntheticEmbeddings(args.n, args.dim, args.topics, args.seed)
+    # Queries are perturbed bank questions, like user paraphrases
+    rng = np.random.default_rng(args.seed + 1)
+    arr_query = arr_emb[rng.integers(0, len(arr_emb), args.queries)]
+    arr_query = arr_query + 0.3 * rng.normal(size=arr_query.shape).astype(np.float32)
+
+    reference = None
+    for precision in PRECISIONS:
+        index = QuestionIndex(arr_emb, precision=precision)
+        index.search(arr_query[0], args.k)  # warm-up
+        list_latency = []
+        list_result = []
+        for query in arr_query:
+            start = time.perf_counter()
+            list_result.append(index.search(query, args.k))
+            list_latency.append(time.perf_counter() - start)
+        if reference is None:
+            reference = list_result
+
+        top1_agreement = np.mean([r[0][0] == ref[0][0] for r, ref in zip(list_result, reference)])
+        topk_overlap = np.mean([len(set(r[0]) & set(ref[0])) / args.k for r, ref in zip(list_result, reference)])
+        top1_score_error = np.max([abs(float(r[1][0]) - float(ref[1][0])) for r, ref in zip(list_result, reference)])
+        arr_latency_ms = np.array(list_latency) * 1000
+        print(json.dumps({
+            "precision": precision,
+            "rows": len(index),
+            "dim": arr_emb.shape[1],
+            "matrix_mb": round(index.nbytes / 2**20, 2),
+            "scan_ms_p50": round(float(np.percentile(arr_latency_ms, 50)), 3),
+            "scan_ms_p95": round(float(np.percentile(arr_latency_ms, 95)), 3),
+            "top1_agreement": round(float(top1_agreement), 4),
+            "topk_overlap": round(float(topk_overlap), 4),
+            "top1_score_max_abs_error": round(float(top1_score_error), 5),
+        }))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# In-process stand-in for MySQL implementing the app.database.mysql_funcs API,
+# so the app can be benchmarked without a database. Rows live in Python dicts;
+# an optional sleep per call emulates a network round trip.
+import json
+import threading
+import time
+import numpy as np
+from app import config
+from app.encoders import encoderId
+
+class FakeMySQL:
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000
+        self._lock = threading.Lock()
+        self.qa = {}  # id -> {"id", "question" (JSON text), "answer"}
+        self.emb = {}  # id -> {"id", "qid", "question", "answer", "question_emb" (bytes)}
+        self.log = []  # change log entries {"version", "qid", "op"}
+        self.jobs = {}  # id -> {"id", "qid", "status", "attempts", "error", "available_at" (monotonic seconds)}
+        self._next_job_id = 1
+        self._next_qa_id = 1
+        self._next_emb_id = 1
+        self._next_version = 1
+        # Encoder of the stored embeddings, recorded as initializeMysql does
+        self.encoder = encoderId()
+
+    def _roundtrip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    # questionAnswer
+    def addQuestionAnswer(self, questions, answer):
+        # Insert a QA row without an embedding job (seeding)
+        with self._lock:
+            id = self._next_qa_id
+            self._next_qa_id += 1
+            self.qa[id] = {"id": id, "question": json.dumps(questions), "answer": answer}
+        return id
+
+    def createQuestionAnswer(self, questions, answer, logger):
+        self._roundtrip()
+        id = self.addQuestionAnswer(questions, answer)
+        return id, self._createEmbeddingJob(id)
+
+    def _sameEncoder(self):
+        # Embeddings of another encoder than the stored ones are refused (see mysql_funcs.bumpQAVersion)
+        return self.encoder == encoderId()
+
+    def createQuestionAnswerBatch(self, list_qa, logger):
+        self._roundtrip()
+        list_id = [self.addQuestionAnswer(questions, answer) for questions, answer in list_qa]
+        for id in list_id:
+            self._createEmbeddingJob(id)
+        return list_id
+
+    def countQuestionAnswer(self, logger):
+        self._roundtrip()
+        return len(self.qa)
+
+    def getQuestionAnswer(self, id, logger):
+        self._roundtrip()
+        return self.qa.get(int(id))
+
+    def updateQuestionAnswer(self, id, questions, answer, logger):
+        self._roundtrip()
+        with self._lock:
+            self.qa[int(id)] = {"id": int(id), "question": json.dumps(questions), "answer": answer}
+        return self._createEmbeddingJob(id)
+
+    def deleteQuestionAnswer(self, id, logger):
+        self._roundtrip()
+        with self._lock:
+            self.qa.pop(int(id), None)
+        self.deleteQuestionEmbedding(id, logger)
+        return self.logQAChange(int(id), "delete", logger)
+
+    def deleteAllQuestionAnswer(self, logger):
+        self._roundtrip()
+        with self._lock:
+            self.qa.clear()
+            self.emb.clear()
+        return self.logQAChange(None, "clear", logger)
+
+    def getAllQuestionAnswer(self, logger):
+        self._roundtrip()
+        with self._lock:
+            return [dict(row) for row in self.qa.values()]
+
+    def getQuestionAnswerPage(self, after_id, limit, logger):
+        self._roundtrip()
+        with self._lock:
+            return [dict(self.qa[id]) for id in sorted(self.qa) if id > after_id][:limit]
+
+    def iterQuestionAnswer(self, logger, batch_size=1000):
+        self._roundtrip()
+        with self._lock:
+            list_row = [dict(self.qa[id]) for id in sorted(self.qa)]
+        for start in range(0, len(list_row), batch_size):
+            yield list_row[start:start + batch_size]
+
+    # questionEmbedding
+    def createQuestionEmbedding(self, list_data, logger):
+        self._roundtrip()
+        with self._lock:
+            for row in list_data:
+                id = self._next_emb_id
+                self._next_emb_id += 1
+                self.emb[id] = {"id": id, "qid": int(row["qid"]), "question": row["question"],
+                                "answer": row["answer"], "question_emb": row["question_emb"]}
+        return True
+
+    def deleteQuestionEmbedding(self, qid, logger):
+        self._roundtrip()
+        with self._lock:
+            for id in [id for id, row in self.emb.items() if row["qid"] == int(qid)]:
+                del self.emb[id]
+        return True
+
+    def deleteAllQuestionEmbedding(self, logger):
+        self._roundtrip()
+        with self._lock:
+            self.emb.clear()
+        return True
+
+    def _matrix(self, list_row):
+        dict_data = {"id": np.array([row["id"] for row in list_row], dtype=np.int64),
+                     "qid": np.array([row["qid"] for row in list_row], dtype=np.int64),
+                     "question": np.array([row["question"] for row in list_row], dtype=object),
+                     "answer": np.array([row["answer"] for row in list_row], dtype=object)}
+        arr_emb = np.array([np.frombuffer(row["question_emb"], dtype="<f4") for row in list_row], dtype=np.float32)
+        return dict_data, arr_emb
+
+    def getAllQuestionEmbeddingMatrix(self, logger):
+        self._roundtrip()
+        with self._lock:
+            list_row = sorted(self.emb.values(), key=lambda row: row["id"])
+            version = self.log[-1]["version"] if self.log else 0
+            encoder = self.encoder
+        dict_data, arr_emb = self._matrix(list_row)
+        return dict_data, arr_emb, version, encoder
+
+    def getQuestionEmbeddingByQids(self, list_qid, logger):
+        self._roundtrip()
+        set_qid = {int(qid) for qid in list_qid}
+        with self._lock:
+            list_row = sorted((row for row in self.emb.values() if row["qid"] in set_qid), key=lambda row: row["id"])
+        return self._matrix(list_row)
+
+    # questionChangeLog
+    def getQAVersion(self, logger):
+        self._roundtrip()
+        with self._lock:
+            return self.log[-1]["version"] if self.log else 0
+
+    def getQAChanges(self, since_version, logger):
+        self._roundtrip()
+        with self._lock:
+            return [dict(change) for change in self.log if change["version"] > since_version]
+
+    def logQAChange(self, qid, op, logger):
+        self._roundtrip()
+        with self._lock:
+            version = self._next_version
+            self._next_version += 1
+            if op in ("clear", "reload"):
+                self.log.clear()
+            self.log.append({"version": version, "qid": qid, "op": op})
+        return version
+
+    # embeddingJob (no lease: the fake never loses a runner)
+    def _createEmbeddingJob(self, qid):
+        with self._lock:
+            id = self._next_job_id
+            self._next_job_id += 1
+            self.jobs[id] = {"id": id, "qid": int(qid), "status": "pending", "attempts": 0, "error": None,
+                             "available_at": time.monotonic()}
+        return id
+
+    def getEmbeddingJob(self, id, logger):
+        self._roundtrip()
+        with self._lock:
+            job = self.jobs.get(int(id))
+            return dict(job) if job is not None else None
+
+    def claimEmbeddingJobs(self, limit, lease, logger):
+        self._roundtrip()
+        now = time.monotonic()
+        with self._lock:
+            list_job = [job for job in self.jobs.values()
+                        if job["status"] == "pending" and job["available_at"] <= now][:limit]
+            for job in list_job:
+                job["status"] = "running"
+                job["attempts"] += 1
+            return [{"id": job["id"], "qid": job["qid"], "attempts": job["attempts"],
+                     "question": self.qa.get(job["qid"], {}).get("question"),
+                     "answer": self.qa.get(job["qid"], {}).get("answer")} for job in list_job]
+
+    def reembedQuestionAnswer(self, encoder, logger):
+        self._roundtrip()
+        with self._lock:
+            self.emb.clear()
+            self.encoder = encoder
+            list_qid = sorted(self.qa)
+        for qid in list_qid:
+            self._createEmbeddingJob(qid)
+        return self.logQAChange(None, "reload", logger), len(list_qid)
+
+    def completeEmbeddingJobs(self, list_result, logger):
+        self._roundtrip()
+        if not self._sameEncoder():
+            return None
+        list_version = []
+        for result in list_result:
+            job = result["job"]
+            version = None
+            row = self.qa.get(job["qid"])
+            if row is not None and (row["question"], row["answer"]) == (job["question"], job["answer"]):
+                self.deleteQuestionEmbedding(job["qid"], logger)
+                self.createQuestionEmbedding([{"qid": job["qid"], "question": question, "answer": job["answer"],
+                                               "question_emb": np.ascontiguousarray(emb, dtype="<f4").tobytes()}
+                                              for question, emb in zip(result["questions"], result["question_emb"])],
+                                             logger)
+                version = self.logQAChange(job["qid"], "upsert", logger)
+            with self._lock:
+                for id in result["list_id"]:
+                    self.jobs[id].update(status="done", error=None)
+            list_version.append(version)
+        return list_version
+
+    def failEmbeddingJobs(self, list_job, error, logger):
+        self._roundtrip()
+        with self._lock:
+            for job in list_job:
+                row = self.jobs[job["id"]]
+                row["status"] = "failed" if row["attempts"] >= config.embedding_jobs["max_attempts"] else "pending"
+                row["error"] = error
+                row["available_at"] = time.monotonic() + config.embedding_jobs["retry_delay"] * 2 ** (row["attempts"] - 1)
+        return True
+
+def install(fake, modules):
+    """
+        Replace every mysql_funcs function implemented by fake in the given modules
+        (mysql_funcs itself and every module that imported functions from it by name)
+    """
+    for module in modules:
+        for name in dir(fake):
+            if not name.startswith("_") and callable(getattr(fake, name)) and hasattr(module, name):
+                setattr(module, name, getattr(fake, name))
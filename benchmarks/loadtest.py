@@ -0,0 +1,317 @@
+# End-to-end load test of the FastAPI app in app/main.py.
+# The app runs in-process against benchmarks.fake_mysql (no MySQL) with a deterministic
+# hashing encoder backend (no model download), and a request log is replayed at a given concurrency.
+#
+#   python -m benchmarks.loadtest --generate 5000 --log bench_requests.jsonl
+#   python -m benchmarks.loadtest --log bench_requests.jsonl --concurrency 32 --output result.json
+#   python -m benchmarks.loadtest --log bench_requests.jsonl --compare result.json
+#
+# Request log: one JSON object per line, {"method": "POST", "path": "/chatbot/ask", "json": {...}}
+# Output: JSON with p50/p95/p99 latency and throughput per endpoint and per pipeline stage.
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.config reads these at import time
+for name in ["MODE", "REDIS_LOGIN_PWD", "MYSQL_LOGIN_PWD", "APP_IP", "APP_PORT", "UI_IP", "UI_PORT"]:
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("LOCALHOST", "127.0.0.1")
+# Load straight from the fake database, no shared snapshot file
+os.environ.setdefault("QA_SNAPSHOT_PATH", "")
+# There is no separate embedding runner process here: the app worker runs the embedding jobs itself
+os.environ.setdefault("EMBEDDING_RUNNER", "app")
+# Sessions in memory, no Redis
+os.environ.setdefault("SESSION_BACKEND", "local")
+# Stored embeddings are tagged with the hashing backend that setupApp installs
+os.environ.setdefault("ENCODER_BACKEND", "hashing")
+
+import numpy as np
+from app.encoders import HashingEncoder
+
+# Synthetic vocabulary: every QA pair is about one topic word plus shared filler words
+FILLER = ["how", "do", "i", "where", "is", "the", "can", "what", "my", "a", "to", "for", "get", "please", "help"]
+
+class HashingModel(HashingEncoder):
+    """
+        The hashing encoder backend with a simulated forward pass cost, recording batch sizes
+        Inputs:
+            dim (int): Embedding dimension
+            encode_ms (float): Simulated cost of one forward pass
+            encode_ms_per_text (float): Simulated extra cost per text in a batch
+    """
+    def __init__(self, dim=384, encode_ms=0.0, encode_ms_per_text=0.0):
+        super().__init__(dim)
+        self.encode_ms = encode_ms
+        self.encode_ms_per_text = encode_ms_per_text
+        self.batch_sizes = []
+
+    def encode(self, list_text, batch_size=32, convert_to_tensor=False):
+        self.batch_sizes.append(len(list_text))
+        cost = self.encode_ms + self.encode_ms_per_text * len(list_text)
+        if cost:
+            time.sleep(cost / 1000)
+        # One simulated forward pass per call, whatever the batch size
+        return super().encode(list_text, batch_size=max(len(list_text), 1))
+
+def seedBank(n_qa, n_variants, seed):
+    """
+        Synthetic QA bank: [(list of questions, answer)]
+    """
+    rng = random.Random(seed)
+    list_qa = []
+    for i in range(n_qa):
+        topic = f"topic{i}"
+        list_q = [" ".join(rng.sample(FILLER, 4) + [topic, f"item{rng.randrange(n_qa)}"]) for _ in range(n_variants)]
+        list_qa.append((list_q, f"Answer for {topic}"))
+    return list_qa
+
+def generateLog(n_requests, list_qa, write_ratio, seed):
+    """
+        Request log mixing verbatim asks, paraphrased asks, unknown asks and admin writes
+    """
+    rng = random.Random(seed)
+    list_record = []
+    for i in range(n_requests):
+        r = rng.random()
+        if r < write_ratio:
+            list_q, answer = rng.choice(list_qa)
+            if rng.random() < 0.5:
+                list_record.append({"method": "POST", "path": "/manage/QA",
+                                    "json": {"question": [q + " new" for q in list_q[:2]], "answer": answer + " (new)"}})
+            else:
+                list_record.append({"method": "PATCH", "path": f"/manage/QA/{rng.randrange(1, len(list_qa) + 1)}",
+                                    "json": {"question": list_q, "answer": answer + " (edited)"}})
+            continue
+        list_q, _ = rng.choice(list_qa)
+        q = rng.choice(list_q)
+        if r < 0.6:
+            text = q
+        elif r < 0.9:
+            words = q.split()
+            rng.shuffle(words)
+            text = " ".join(words[:-1]) + "?"
+        else:
+            text = " ".join(rng.sample(FILLER, 5))
+        list_record.append({"method": "POST", "path": "/chatbot/ask",
+                            "json": {"uid": f"u{i % 1000}", "ask_text": text, "state": "Asking"}})
+    return list_record
+
+class StageTimer:
+    """
+        Collects durations of named pipeline stages by wrapping functions and methods
+    """
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    def wrap(self, owner, attr, stage):
+        func = getattr(owner, attr)
+        durations = self.durations[stage]
+        if asyncio.iscoroutinefunction(func):
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - start)
+        else:
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - start)
+        setattr(owner, attr, wrapper)
+
+    def reset(self):
+        for durations in self.durations.values():
+            durations.clear()
+
+def summarize(list_seconds, elapsed=None):
+    arr_ms = np.array(list_seconds) * 1000
+    if arr_ms.size == 0:
+        return {"count": 0}
+    summary = {
+        "count": int(arr_ms.size),
+        "mean_ms": round(float(arr_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr_ms, 99)), 3),
+        "max_ms": round(float(arr_ms.max()), 3),
+    }
+    if elapsed:
+        summary["throughput_rps"] = round(arr_ms.size / elapsed, 2)
+    return summary
+
+def endpointKey(record):
+    return f"{record['method']} {re.sub(r'/[0-9]+', '/{id}', record['path'])}"
+
+def setupApp(args):
+    """
+        Import the app with the fake database and the hashing encoder installed
+    """
+    os.chdir(REPO_ROOT)
+    os.makedirs("app/logs", exist_ok=True)
+    from app import config, embedding_jobs, model_func, qa_import
+    from app.database import mysql_funcs
+    from app.main import app
+    from app.routers import QA_manage, chatbotAPI
+    from benchmarks import fake_mysql
+
+    fake = fake_mysql.FakeMySQL(latency_ms=args.db_latency_ms)
+    fake_mysql.install(fake, [mysql_funcs, chatbotAPI, QA_manage, qa_import, embedding_jobs])
+
+    # Shared encoder of the process: the hashing backend, with the simulated costs
+    hashing_model = HashingModel(dim=args.dim, encode_ms=args.encode_ms, encode_ms_per_text=args.encode_ms_per_text)
+    encoder = model_func.SentenceBert(config.model_name, backend="hashing")
+    encoder.model = hashing_model
+    model_func._models[config.model_name] = encoder
+
+    # Seed the bank directly in the fake database
+    for list_q, answer in seedBank(args.qa, args.variants, args.seed):
+        list_q = [model_func.normalize_text(q) for q in list_q]
+        qid = fake.addQuestionAnswer(list_q, answer)
+        arr_emb = hashing_model.encode(list_q)
+        fake.createQuestionEmbedding([{"qid": qid, "question": q, "answer": answer,
+                                       "question_emb": mysql_funcs.encodeEmbedding(emb)}
+                                      for q, emb in zip(list_q, arr_emb)], None)
+        fake.logQAChange(qid, "upsert", None)
+    hashing_model.batch_sizes.clear()
+
+    timer = StageTimer()
+    timer.wrap(chatbotAPI, "normalize_text", "normalize")
+    timer.wrap(model_func.EncoderScheduler, "encode", "encode")
+    timer.wrap(model_func.QuestionIndex, "search", "search")
+    timer.wrap(chatbotAPI, "runDB", "db")
+    timer.wrap(QA_manage, "runDB", "db")
+    return app, timer, hashing_model, encoder
+
+async def replay(app, list_record, concurrency, timer, warmup):
+    import httpx
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            async def send(record):
+                start = time.perf_counter()
+                try:
+                    response = await client.request(record["method"], record["path"], json=record.get("json"))
+                    ok = response.status_code < 400 and "error" not in response.text.lower()
+                except Exception:
+                    ok = False
+                return endpointKey(record), ok, time.perf_counter() - start
+
+            for record in list_record[:warmup]:
+                await send(record)
+            timer.reset()
+
+            queue = asyncio.Queue()
+            for record in list_record[warmup:]:
+                queue.put_nowait(record)
+
+            async def worker():
+                while not queue.empty():
+                    results.append(await send(queue.get_nowait()))
+
+            start = time.perf_counter()
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+            elapsed = time.perf_counter() - start
+    return results, elapsed
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def compare(result, baseline):
+    """
+        Print relative change of latency percentiles and throughput against a previous result
+    """
+    def row(name, new, old):
+        cells = []
+        for metric in ["p50_ms", "p95_ms", "p99_ms", "throughput_rps"]:
+            if metric in new and old.get(metric):
+                cells.append(f"{metric} {old[metric]} -> {new[metric]} ({(new[metric] / old[metric] - 1) * 100:+.1f}%)")
+        print(f"{name:32s} " + "  ".join(cells))
+    print(f"baseline {baseline.get('commit')} vs current {result.get('commit')}")
+    row("total", result["total"], baseline.get("total", {}))
+    for group in ["endpoints", "stages"]:
+        for name, summary in result[group].items():
+            row(f"{group[:-1]} {name}", summary, baseline.get(group, {}).get(name, {}))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request log against the app with a fake MySQL and a stub encoder")
+    parser.add_argument("--log", help="Request log (JSONL) to replay, or to write with --generate")
+    parser.add_argument("--generate", type=int, default=0, help="Write a synthetic request log of this many requests to --log and exit")
+    parser.add_argument("--requests", type=int, default=2000, help="Synthetic requests to replay when no --log is given")
+    parser.add_argument("--write-ratio", type=float, default=0.01, help="Share of admin writes in a synthetic log")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=50, help="Requests sent before measuring")
+    parser.add_argument("--qa", type=int, default=500, help="QA pairs seeded in the fake database")
+    parser.add_argument("--variants", type=int, default=5, help="Questions per QA pair")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--encode-ms", type=float, default=0.0, help="Simulated cost of one encoder call")
+    parser.add_argument("--encode-ms-per-text", type=float, default=0.0, help="Simulated extra cost per encoded text")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="Simulated MySQL round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON result here (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON result to compare against")
+    args = parser.parse_args()
+
+    if args.generate:
+        list_record = generateLog(args.generate, seedBank(args.qa, args.variants, args.seed), args.write_ratio, args.seed)
+        with open(args.log, "w") as f:
+            for record in list_record:
+                f.write(json.dumps(record) + "\n")
+        print(f"wrote {len(list_record)} requests to {args.log}", file=sys.stderr)
+        return
+
+    if args.log:
+        with open(args.log) as f:
+            list_record = [json.loads(line) for line in f if line.strip()]
+    else:
+        list_record = generateLog(args.requests, seedBank(args.qa, args.variants, args.seed), args.write_ratio, args.seed)
+
+    app, timer, hashing_model, encoder = setupApp(args)
+    results, elapsed = asyncio.run(replay(app, list_record, args.concurrency, timer, args.warmup))
+
+    by_endpoint = defaultdict(list)
+    errors = defaultdict(int)
+    for key, ok, seconds in results:
+        by_endpoint[key].append(seconds)
+        errors[key] += not ok
+    result = {
+        "commit": gitCommit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "total": {**summarize([seconds for _, _, seconds in results], elapsed), "errors": sum(errors.values())},
+        "endpoints": {key: {**summarize(list_seconds, elapsed), "errors": errors[key]}
+                      for key, list_seconds in sorted(by_endpoint.items())},
+        "stages": {stage: summarize(list_seconds) for stage, list_seconds in sorted(timer.durations.items())},
+        "encoder": {"batches": len(hashing_model.batch_sizes),
+                    "mean_batch_size": round(float(np.mean(hashing_model.batch_sizes)), 2) if hashing_model.batch_sizes else 0,
+                    "cache": encoder.cache.stats()},
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import json
 import multiprocessing
 import os
+import shutil
 
 workers_per_core_str = os.getenv("WORKERS_PER_CORE", "0.1")
 max_workers_str = os.getenv("MAX_WORKERS")
@@ -35,6 +36,10 @@ use_errorlog = errorlog_var or None
 graceful_timeout_str = os.getenv("GRACEFUL_TIMEOUT", "6000")
 timeout_str = os.getenv("TIMEOUT", "6000")
 keepalive_str = os.getenv("KEEP_ALIVE", "5")
+# Load the app (model weights, QA data) once in the master and fork the workers from it (see app/config.py)
+preload_str = os.getenv("PRELOAD_APP", "false")
+# Every worker writes its Prometheus samples here, so /metrics aggregates all workers
+prometheus_multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/dev/shm/chatbot-metrics")
 
 # Gunicorn config variables
 loglevel = use_loglevel
@@ -46,6 +51,35 @@ accesslog = use_accesslog
 graceful_timeout = int(graceful_timeout_str)
 timeout = int(timeout_str)
 keepalive = int(keepalive_str)
+preload_app = preload_str.lower() == "true"
+
+
+def reset_metrics_dir():
+    # Samples of a previous run would otherwise be added to the new ones
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+if preload_app:
+    # A preloading master imports the app, which creates its metric files, before on_starting
+    reset_metrics_dir()
+
+
+def on_starting(server):
+    if not preload_app:
+        reset_metrics_dir()
+
+
+def when_ready(server):
+    # A preloaded master set the index gauges while loading; only workers serve requests
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(os.getpid())
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a dead worker; its counters and histograms are kept
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
 
 
 # For debugging and testing
@@ -56,6 +90,7 @@ log_data = {
     "graceful_timeout": graceful_timeout,
     "timeout": timeout,
     "keepalive": keepalive,
+    "preload_app": preload_app,
     "errorlog": errorlog,
     "accesslog": accesslog,
     # Additional, non-gunicorn variables
@@ -63,5 +98,6 @@ log_data = {
     "use_max_workers": use_max_workers,
     "host": host,
     "port": port,
+    "prometheus_multiproc_dir": prometheus_multiproc_dir,
 }
 print(json.dumps(log_data))
\ No newline at end of file